@@ -0,0 +1,143 @@
+"""
+CACHING: bounded LRU cache of per-record results (prediction, explanations),
+keyed by a hash of the preprocessed features, the model fingerprint and what
+was requested, so that re-scoring identical inputs skips the model.
+
+Disabled unless CACHE_ENTRIES and/or CACHE_BYTES environment variables are
+set (to the maximum number of entries and bytes respectively).
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+import numpy as np
+
+
+def from_environment():
+    """
+    Cache configured by environment variables, or None when not configured.
+    """
+    max_entries = os.environ.get("CACHE_ENTRIES")
+    max_bytes = os.environ.get("CACHE_BYTES")
+    if max_entries is None and max_bytes is None:
+        return None
+    return LRUCache(
+        max_entries=int(max_entries) if max_entries else None,
+        max_bytes=int(max_bytes) if max_bytes else None
+    )
+
+
+def fingerprint(filepaths):
+    """
+    Hash of the contents of the model files.
+    """
+    digest = hashlib.sha256()
+    for filepath in sorted(Path(f) for f in filepaths):
+        digest.update(filepath.name.encode())
+        digest.update(filepath.read_bytes())
+    return digest.hexdigest()
+
+
+def record_keys(features, model_fingerprint, targets, parameters):
+    """
+    One key per record (row of features). Features are converted to float64
+    so that equal values give equal keys regardless of dtype.
+    """
+    features = np.ascontiguousarray(features, dtype=np.float64)
+    request = json.dumps([model_fingerprint, sorted(targets), parameters], sort_keys=True)
+    prefix = hashlib.blake2b(request.encode(), digest_size=16).digest()
+    return [
+        hashlib.blake2b(prefix + row.tobytes(), digest_size=16).digest()
+        for row in features
+    ]
+
+
+def nbytes(value):
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    return np.asarray(value).nbytes
+
+
+class LRUCache:
+    """
+    Least recently used entries are evicted when there are more than
+    `max_entries` entries, or when entries take more than `max_bytes` bytes
+    (counting array data only). Either limit can be None. Safe to share
+    between threads.
+    """
+    def __init__(self, max_entries=None, max_bytes=None):
+        assert (max_entries is not None) or (max_bytes is not None), \
+            "max_entries or max_bytes should be given."
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._entries and self._over_limit():
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _over_limit(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    def counters(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._bytes = 0
+
+
+def take(value, idx):
+    """
+    Result of a single record, copied so it doesn't keep the batch alive.
+    """
+    if isinstance(value, dict):
+        return {k: take(v, idx) for k, v in value.items()}
+    return np.array(value[idx])
+
+
+def stack(values):
+    """
+    Inverse of `take`, for a list of records.
+    """
+    if isinstance(values[0], dict):
+        return {k: stack([value[k] for value in values]) for k in values[0]}
+    return np.stack(values)
@@ -1,12 +1,49 @@
-# flake8: noqa: F401
-import os
+"""
+ENTRY POINT: run in 'script mode' for training (see `__main__` block), and
+imported by the serving container, which looks up the deployment functions.
+
+Training and deployment functions are imported when first called, so
+serving doesn't import the training code (LightGBM training, sklearn model
+selection, etc.) and training doesn't import the serving code.
+"""
+import importlib
 import sys
 
-# import training function
-from training import parse_args, train_fn
+import timing
+
+
+def _import(module_name):
+    # timed as 'import_<module>' with STARTUP_PROFILE (once, when first used)
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    stage = "import_{}".format(module_name)
+    return timing.timed(timing.STARTUP, stage, importlib.import_module, module_name)
+
+
+# training functions
+def parse_args(sys_args):
+    return _import("training").parse_args(sys_args)
+
+
+def train_fn(args):
+    return _import("training").train_fn(args)
+
+
+# deployment functions
+def model_fn(model_dir):
+    return _import("explaining").model_fn(model_dir)
+
+
+def input_fn(request_body_str, request_content_type):
+    return _import("explaining").input_fn(request_body_str, request_content_type)
+
+
+def predict_fn(request, model_assets):
+    return _import("explaining").predict_fn(request, model_assets)
+
 
-# import deployment functions
-from explaining import model_fn, predict_fn, input_fn, output_fn
+def output_fn(prediction, response_content_type):
+    return _import("explaining").output_fn(prediction, response_content_type)
 
 
 if __name__ == "__main__":
@@ -4,129 +4,788 @@ by the endpoint
 """
 import numpy as np
 from pathlib import Path
+import csv
+import functools
+import io
 import json
-import joblib
-import shap
-import warnings
 
 from package.data import schemas
+from explainers import Explainer
+from grouping import FieldGroups
+from reasons import ReasonCodes, top_k_reasons
+from preprocessing import CompiledPreprocessor
+from planning import Plan, Step
+import batching
+import bundles
+import caching
+import models
+import timing
+from responses import (
+    Predictions,
+    ACCEPT_TYPES,
+    SHARED_KEYS,
+    KEY_SEPARATOR,
+    CSV_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    JSONLINES_CONTENT_TYPE,
+    NPZ_CONTENT_TYPE,
+    scatter_rows
+)
 
 
 def model_fn(model_dir):
+    if models.enabled():
+        # a folder per model, each loaded when first requested (see `models.py`)
+        registry = models.from_environment(model_dir, load_hosted_model, unload_model)
+        timing.register_counters('models', registry.counters)
+        model_assets = {"models": registry}
+    else:
+        model_assets = load_model(model_dir)
+    if timing.ENABLED:
+        timing.dump_on_signal()
+    if timing.STARTUP is not None:
+        timing.STARTUP.log("startup")
+    return model_assets
+
+
+def load_model(model_dir, counters_name='cache'):
     model_dir = Path(model_dir)
+    bundle_path = Path(model_dir, bundles.FILENAME)
+    if bundle_path.exists():
+        model_assets = timing.timed(timing.STARTUP, 'load_bundle', load_bundle, bundle_path)
+    else:
+        model_assets = timing.timed(timing.STARTUP, 'load_legacy', load_legacy, model_dir)
+    # features of each data field (e.g. one-hot categories), to group SHAP values
+    model_assets["field_groups"] = timing.timed(
+        timing.STARTUP, 'group_fields', FieldGroups.from_schemas,
+        model_assets["data_schema"], model_assets["features_schema"]
+    )
+    model_assets["reason_codes"] = ReasonCodes.from_model_dir(
+        model_dir, model_assets["data_schema"], model_assets["field_groups"].fields
+    )
+    # optional cache of results (keyed by the model files too)
+    cache = caching.from_environment()
+    model_assets["cache"] = cache
+    if cache is not None:
+        model_assets["counters_name"] = counters_name
+        timing.register_counters(counters_name, cache.counters)
+    # optional coalescing of concurrent requests into batches
+    model_assets["coalescer"] = batching.from_environment(
+        functools.partial(predict_requests, model_assets=model_assets)
+    )
+    return model_assets
+
+
+def load_hosted_model(model_dir):
+    # cache counters of each model, e.g. 'cache/<model id>'
+    return load_model(model_dir, counters_name="cache/" + Path(model_dir).name)
+
+
+def unload_model(model_assets):
+    if model_assets["coalescer"] is not None:
+        model_assets["coalescer"].close()
+    if model_assets["cache"] is not None:
+        # only this copy's counters, in case the model was loaded again since
+        timing.unregister_counters(model_assets["counters_name"], model_assets["cache"].counters)  # noqa
+
+
+def load_bundle(bundle_path):
+    """
+    Model assets from a model bundle: sklearn isn't used, since the bundle
+    contains the compiled preprocessor and compiled trees.
+    """
+    data_schema, features_schema, compiled_preprocessor, trees, checksum = \
+        bundles.load_model_bundle(bundle_path)
+    return {
+        "data_schema": data_schema,
+        "features_schema": features_schema,
+        "preprocessor": None,
+        "compiled_preprocessor": compiled_preprocessor,
+        "classifier": None,
+        "explainer": Explainer.from_trees(trees),
+        "fingerprint": checksum
+    }
+
+
+def load_legacy(model_dir):
+    """
+    Model assets from schemas and joblib files (i.e. without model bundle).
+    """
+    # only imported here, since unpickling imports sklearn and lightgbm too
+    import joblib
+
+    startup = timing.STARTUP
     # load schemas
     data_schema_path = Path(model_dir, "data.schema.json")
     data_schema = schemas.from_json_schema(data_schema_path)
     features_schema_path = Path(model_dir, "features.schema.json")
     features_schema = schemas.from_json_schema(features_schema_path)
     # load preprocessor and classifier
-    preprocessor = joblib.load(Path(model_dir, "preprocessor.joblib"))
-    classifier = joblib.load(Path(model_dir, "classifier.joblib"))
-    # create explainer (wraps classifier)
-    explainer = shap.TreeExplainer(classifier)
+    preprocessor_path = Path(model_dir, "preprocessor.joblib")
+    preprocessor = timing.timed(startup, 'load_preprocessor', joblib.load, preprocessor_path)
+    classifier_path = Path(model_dir, "classifier.joblib")
+    classifier = timing.timed(startup, 'load_classifier', joblib.load, classifier_path)
+    # compile preprocessor for single records (None if not compilable)
+    compiled_preprocessor = timing.timed(
+        startup, 'compile_preprocessor',
+        CompiledPreprocessor.from_preprocessor, preprocessor, data_schema
+    )
+    # create explainer (wraps classifier, shared by all requests)
+    explainer = timing.timed(startup, 'create_explainer', Explainer, classifier)
+    fingerprint = caching.fingerprint(
+        [data_schema_path, features_schema_path, preprocessor_path, classifier_path]
+    )
     # combine into single dict
     model_assets = {
         "data_schema": data_schema,
         "features_schema": features_schema,
         "preprocessor": preprocessor,
+        "compiled_preprocessor": compiled_preprocessor,
         "classifier": classifier,
-        "explainer": explainer
+        "explainer": explainer,
+        "fingerprint": fingerprint
     }
     return model_assets
 
 
-def assert_json(content_type):
+CONTENT_TYPES = set([JSON_CONTENT_TYPE, JSONLINES_CONTENT_TYPE, CSV_CONTENT_TYPE])
+# content type fields (other than entities) given as 'key=value'
+CONTENT_TYPE_PARAMETERS = set(['interaction_pairs', 'approximate', 'model'])
+DEFAULT_INTERACTIONS_TOPK = 10
+DEFAULT_SHAP_VALUES_TOPK = 10
+DEFAULT_REASON_CODES = 4
+# batches from this size are preprocessed as typed columns (rather than
+# record by record), which is faster for large batches only
+COLUMNS_MIN_RECORDS = 1024
+
+
+def assert_content_type(content_type):
     assert (
-        content_type == "application/json"
-    ), "content_type must be 'application/json'"
+        content_type in CONTENT_TYPES
+    ), "content_type must be one of {}".format(sorted(CONTENT_TYPES))
 
 
 def parse_entities(entities):
+    """
+    Parses 'entities=a,b=1,c' into entity names and entity parameters,
+    i.e. ['a', 'b', 'c'] and {'b': '1'}.
+    """
     entities = entities.strip()
-    entities = entities.split('=')
+    entities = entities.split('=', 1)
     assert entities[0] == 'entities', 'Unexpected field in content type.'
     entities = entities[1]
     entities = entities.split(',')
-    return entities
+    names, parameters = [], {}
+    for entity in entities:
+        name, _, value = entity.partition('=')
+        names.append(name)
+        if value:
+            parameters[name] = value
+    return names, parameters
+
+
+def parse_interaction_pairs(interaction_pairs, feature_names):
+    """
+    Parses 'feature_a:feature_b|feature_c:feature_d' into an array of
+    feature index pairs.
+    """
+    feature_idxs = {name: idx for idx, name in enumerate(feature_names)}
+    pairs = []
+    for pair in interaction_pairs.split('|'):
+        pair = pair.split(':')
+        assert len(pair) == 2, "interaction_pairs should be 'a:b|c:d'."
+        for name in pair:
+            assert name in feature_idxs, "Unknown feature '{}'.".format(name)
+        pairs.append([feature_idxs[name] for name in pair])
+    return np.array(pairs)
+
+
+def parse_topk(parameters, key, default):
+    """
+    Number of values (k) of a top-k entity, e.g. 'explanation_shap_values_topk=5'.
+    """
+    k = int(parameters.get(key, default))
+    assert k >= 0, "{} should be a non-negative integer, not {}.".format(key, k)
+    return k
+
+
+def is_batch(data):
+    # a single record can also be given as a list of values,
+    # so only a list of records (dicts or lists) is treated as a batch
+    return isinstance(data, list) and all(
+        isinstance(record, (dict, list)) for record in data
+    )
+
+
+class InvalidRecord:
+    """
+    Stands for a record that couldn't be parsed (e.g. a malformed JSON line),
+    with the parse error and the data as given (e.g. the line), so that only
+    this record fails.
+    """
+    def __init__(self, error, data):
+        self.error = error
+        self.data = data
+
+
+def record_data(record):
+    return record.data if isinstance(record, InvalidRecord) else record
+
+
+def parse_data(request_body_str, content_type):
+    """
+    Data and whether it's a batch. JSON Lines and CSV bodies are always a
+    batch (of one record per line), and CSV records are lists of strings
+    (without header, in data schema order) until converted by `predict_fn`.
+    """
+    if content_type == JSONLINES_CONTENT_TYPE:
+        data = []
+        for line in request_body_str.splitlines():
+            if not line.strip():
+                continue
+            try:
+                data.append(json.loads(line))
+            except ValueError as error:
+                data.append(InvalidRecord(error, line))
+        return data, True
+    if content_type == CSV_CONTENT_TYPE:
+        rows = csv.reader(io.StringIO(request_body_str))
+        data = [row for row in rows if row]
+        return data, True
+    data = json.loads(request_body_str)
+    return data, is_batch(data)
 
 
 def input_fn(request_body_str, request_content_type):
+    timings = timing.start()
+    request = timing.timed(
+        timings, 'input_fn', parse_request, request_body_str, request_content_type
+    )
+    request['timings'] = timings
+    if timings is not None:
+        timings.size('request_bytes', len(request_body_str))
+        timings.size('records', len(request['data']) if request['batch'] else 1)
+    return request
+
+
+def parse_request(request_body_str, request_content_type):
     fields = request_content_type.split(';')
-    if len(fields) == 1:
-        content_type = request_content_type[0]
-        entities = ["predictions"]  # default entity
-    elif len(fields) == 2:
-        content_type, entities = fields
-        entities = parse_entities(entities)
-    else:
-        raise Exception('Unexpected field in content_type.')
-    assert_json(content_type)
+    content_type = fields[0].strip()
+    entities = ["predictions"]  # default entity
+    parameters = {}
+    for field in fields[1:]:
+        key, _, value = field.strip().partition('=')
+        if key == 'entities':
+            entities, entity_parameters = parse_entities(field)
+            parameters.update(entity_parameters)
+        elif key in CONTENT_TYPE_PARAMETERS:
+            parameters[key] = value
+        else:
+            raise Exception('Unexpected field in content_type.')
+    assert_content_type(content_type)
+    data, batch = parse_data(request_body_str, content_type)
     request = {
-        'data': json.loads(request_body_str),
-        'entities': entities
+        'data': data,
+        'entities': entities,
+        'parameters': parameters,
+        'batch': batch,
+        'content_type': content_type
     }
     return request
 
 
-def preprocess_fn(data, model_assets):
-    model_assets["data_schema"].validate(data)
-    data = model_assets["data_schema"].transform(data)
-    data = np.expand_dims(data, axis=0)
-    features = model_assets["preprocessor"].transform(data)
-    return features
+def validate_fn(records, model_assets):
+    for record in records:
+        if isinstance(record, InvalidRecord):
+            raise record.error
+        model_assets["data_schema"].validate(record)
+    return records
+
+
+def validate_records(records, model_assets):
+    """
+    Exception of each record that isn't valid, or None if it's valid.
+    """
+    errors = [record.error if isinstance(record, InvalidRecord) else None for record in records]  # noqa
+    idxs = [idx for idx, error in enumerate(errors) if error is None]
+    if len(idxs) == len(records):
+        return model_assets["data_schema"].validate_batch(records)
+    parsed = [records[idx] for idx in idxs]
+    for idx, error in zip(idxs, model_assets["data_schema"].validate_batch(parsed)):
+        errors[idx] = error
+    return errors
 
 
 def predict_fn(request, model_assets):
-    data = request['data']
     entities = request['entities']
-    response = {}
-    if 'data' in entities:
-        response['data'] = data
-    features = preprocess_fn(data, model_assets)
-    if 'features' in entities:
-        feature_names = model_assets["features_schema"].item_titles
-        feature_values = features[0].tolist()
-        response['features'] = {k: v for k, v in zip(feature_names, feature_values)}
-    if 'descriptions' in entities:
-        response['descriptions'] = model_assets["features_schema"].item_descriptions_dict
-    if 'prediction' in entities:
-        prediction = model_assets["classifier"].predict_proba(features)
-        # take first sample (idx=0)
-        # and second probability (idx=1) corresponding to the positive class
-        response['prediction'] = prediction[0][1].tolist()
-    if ('explanation_shap_values' in entities) or ('explanation_shap_interaction_values' in entities):
-        explanation = {}
-        expected_value = model_assets["explainer"].expected_value
-        # see https://github.com/slundberg/shap/issues/729: handle both cases
-        if expected_value.shape == (1,):
-            explanation['expected_value'] = expected_value[0].tolist()
-        else:
-            explanation['expected_value'] = expected_value[1].tolist()
-        if 'explanation_shap_values' in entities:
-            # second probability (idx=1) corresponding to the positive class
-            # and take first sample (idx=0)
-            feature_names = model_assets["features_schema"].item_titles
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                shap_values = model_assets["explainer"].shap_values(features)[1][0]
-            explanation['shap_values'] = {k: v for k, v in zip(feature_names, shap_values.tolist())}
-        if 'explanation_shap_interaction_values' in entities:
-            labels = model_assets["features_schema"].item_titles
-            # take first sample (idx=0)
-            values = model_assets["explainer"].shap_interaction_values(features)[0].tolist()
-            explanation['shap_interaction_values'] = {
-                'labels': labels,
-                'values': values
-            }
-        # see https://github.com/slundberg/shap/issues/729: setting back to original
-        model_assets["explainer"].expected_value = expected_value
-        response['explanation'] = explanation
-    return response
-
-
-def output_fn(response, response_content_type):
+    parameters = request.get('parameters', {})
+    timings = request.get('timings')
+    if "models" in model_assets:
+        model_id = parameters.get('model')
+        assert model_id is not None, "The content type should give the model, e.g. 'model=<id>'."  # noqa
+        model_assets = timing.timed(timings, 'model', model_assets["models"].get, model_id)
+    if request.get('content_type') == CSV_CONTENT_TYPE:
+        data_schema = model_assets["data_schema"]
+        data = timing.timed(timings, 'parse_rows', parse_rows, request['data'], data_schema)
+        request = dict(request, data=data)
+    if model_assets.get("coalescer") is not None:
+        return predict_coalesced(request, model_assets)
+    if request.get('batch', False):
+        return predict_batch(
+            request['data'], entities, model_assets, parameters, timings=timings
+        )
+    return predict_batch(
+        [request['data']], entities, model_assets, parameters, batch=False, timings=timings
+    )
+
+
+def parse_rows(rows, data_schema):
+    """
+    Converts columns of strings at once to the data schema types, or else
+    each row: rows that can't be converted become an InvalidRecord with
+    the conversion error, so that they fail on their own.
+    """
+    try:
+        return data_schema.parse_rows(rows)
+    except ValueError:
+        records = []
+        for row in rows:
+            try:
+                records.extend(data_schema.parse_rows([row]))
+            except ValueError as error:
+                records.append(InvalidRecord(error, row))
+        return records
+
+
+def predict_coalesced(request, model_assets):
+    """
+    Predictions of the request, computed in a batch with concurrent requests
+    that have the same entities and parameters.
+    """
+    batch = request.get('batch', False)
+    records = request['data'] if batch else [request['data']]
+    parameters = request.get('parameters', {})
+    key = (tuple(request['entities']), tuple(sorted(parameters.items())))
+    timings = request.get('timings')
+    coalescer = model_assets["coalescer"]
+    predictions = timing.timed(timings, 'coalesced', coalescer.submit, key, records)
+    if not batch and predictions.errors is not None and predictions.errors[0] is not None:
+        raise predictions.errors[0]
+    predictions.batch = batch
+    predictions.timings = timings
+    return predictions
+
+
+def predict_requests(key, requests, model_assets):
+    """
+    Predictions of each request (list of records) with the same `key`, i.e.
+    entities and parameters, from a single batch.
+    """
+    entities, parameters = list(key[0]), dict(key[1])
+    records = [record for request in requests for record in request]
+    predictions = predict_batch(records, entities, model_assets, parameters)
+    results = []
+    start = 0
+    for request in requests:
+        results.append(predictions.take(start, start + len(request)))
+        start += len(request)
+    return results
+
+
+def top_k_features(shap_values, k):
+    """
+    Indexes and SHAP values of the k features with the largest absolute SHAP
+    value for each record (in decreasing order), and the sum of the SHAP
+    values of all other features.
+    """
+    k = min(k, shap_values.shape[1])
+    if k == 0:
+        idxs = np.zeros((len(shap_values), 0), dtype=np.int64)
+        return idxs, shap_values[:, :0], shap_values.sum(axis=1)
+    magnitudes = np.abs(shap_values)
+    idxs = np.argpartition(-magnitudes, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(magnitudes, idxs, axis=1), axis=1)
+    idxs = np.take_along_axis(idxs, order, axis=1)
+    values = np.take_along_axis(shap_values, idxs, axis=1)
+    return idxs, values, shap_values.sum(axis=1) - values.sum(axis=1)
+
+
+def top_k_interactions(interaction_values, k, pairs=None):
+    """
+    Upper triangular (i < j) interaction values, keeping only the k pairs
+    with the largest absolute value for each record, in decreasing order.
+    Interaction values are symmetric, so value (i, j) is also value (j, i).
+    Candidate pairs can be restricted to `pairs` (an array of index pairs).
+    """
+    if pairs is None:
+        rows, columns = np.triu_indices(interaction_values.shape[1], k=1)
+    else:
+        pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        rows, columns = pairs[:, 0], pairs[:, 1]
+    values = interaction_values[:, rows, columns]
+    k = min(k, values.shape[1])
+    if k == 0:
+        empty = np.zeros((len(values), 0), dtype=np.int64)
+        return empty, empty, values[:, :0]
+    magnitudes = np.abs(values)
+    idxs = np.argpartition(-magnitudes, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(magnitudes, idxs, axis=1), axis=1)
+    idxs = np.take_along_axis(idxs, order, axis=1)
+    return rows[idxs], columns[idxs], np.take_along_axis(values, idxs, axis=1)
+
+
+# steps computing the intermediate results of a request: each is called with
+# the context (records, model_assets and parameters) and the required results
+def data_step(context):
+    return [record_data(record) for record in context["records"]]
+
+
+def descriptions_step(context):
+    return context["model_assets"]["features_schema"].item_descriptions_dict
+
+
+def expected_value_step(context):
+    return context["model_assets"]["explainer"].expected_value
+
+
+def records_step(context):
+    if context.get("validated", False):
+        return context["records"]
+    return validate_fn(context["records"], context["model_assets"])
+
+
+def array_step(context, records):
+    return context["model_assets"]["data_schema"].transform_batch(records)
+
+
+def features_step(context, array):
+    features = context["model_assets"]["preprocessor"].transform(array)
+    # e.g. a sparse OneHotEncoder (such preprocessors aren't compiled)
+    return features.toarray() if hasattr(features, "toarray") else features
+
+
+def compiled_features_step(context, records):
+    compiled_preprocessor = context["model_assets"]["compiled_preprocessor"]
+    return compiled_preprocessor.transform(records)
+
+
+def columns_step(context, records):
+    return context["model_assets"]["data_schema"].transform_columns(records)
+
+
+def columns_features_step(context, columns):
+    compiled_preprocessor = context["model_assets"]["compiled_preprocessor"]
+    return compiled_preprocessor.transform_columns(columns)
+
+
+def shap_values_step(context, features):
+    return context["model_assets"]["explainer"].shap_values(features)
+
+
+def approximate_shap_values_step(context, features):
+    return context["model_assets"]["explainer"].approximate_shap_values(features)
+
+
+def shap_values_from_interactions_step(context, interaction_values):
+    return interaction_values.sum(axis=2)
+
+
+def interaction_values_step(context, features):
+    return context["model_assets"]["explainer"].shap_interaction_values(features)
+
+
+def interaction_pairs_step(context):
+    feature_names = context["model_assets"]["features_schema"].item_titles
+    return parse_interaction_pairs(context["parameters"]["interaction_pairs"], feature_names)
+
+
+def pair_interaction_values_step(context, features, interaction_pairs):
+    explainer = context["model_assets"]["explainer"]
+    return explainer.shap_interaction_values(features, pairs=interaction_pairs)
+
+
+def shap_values_topk_step(context, shap_values):
+    parameters = context["parameters"]
+    k = parse_topk(parameters, 'explanation_shap_values_topk', DEFAULT_SHAP_VALUES_TOPK)
+    idxs, values, other_features = top_k_features(shap_values, k)
+    return {'idxs': idxs, 'values': values, 'other_features': other_features}
+
+
+def shap_values_grouped_step(context, shap_values):
+    return context["model_assets"]["field_groups"].sum(shap_values)
+
+
+def reason_codes_step(context, shap_values_grouped):
+    parameters = context["parameters"]
+    k = parse_topk(parameters, 'explanation_reason_codes', DEFAULT_REASON_CODES)
+    idxs, values = top_k_reasons(shap_values_grouped, k)
+    return {'idxs': idxs, 'values': values}
+
+
+def interactions_topk_step(context, interaction_values):
+    return interactions_topk(context["parameters"], interaction_values)
+
+
+def pair_interactions_topk_step(context, pair_interaction_values, interaction_pairs):
+    return interactions_topk(context["parameters"], pair_interaction_values, interaction_pairs)
+
+
+def native_margin_step(context, features):
+    return context["model_assets"]["explainer"].predict_margin(features)
+
+
+def margin_step(context, shap_values):
+    return context["model_assets"]["explainer"].margin(shap_values)
+
+
+def prediction_step(context, features):
+    # second probability (idx=1) corresponding to the positive class
+    return context["model_assets"]["classifier"].predict_proba(features)[:, 1]
+
+
+def prediction_from_margin_step(context, margin):
+    return context["model_assets"]["explainer"].margin_to_proba(margin)
+
+
+def interactions_topk(parameters, interaction_values, pairs=None):
+    k = parse_topk(parameters, 'explanation_shap_interactions_topk', DEFAULT_INTERACTIONS_TOPK)
+    rows, columns, values = top_k_interactions(interaction_values, k, pairs)
+    topk = {'rows': rows, 'columns': columns, 'values': values}
+    # main effects aren't computed when restricted to pairs
+    if pairs is None:
+        topk['diagonal'] = np.diagonal(interaction_values, axis1=1, axis2=2)
+    return topk
+
+
+STEPS = {
+    'data': Step([], data_step),
+    'descriptions': Step([], descriptions_step),
+    'expected_value': Step([], expected_value_step),
+    'records': Step([], records_step),
+    'array': Step(['records'], array_step),
+    'features': Step(['array'], features_step),
+    'shap_values': Step(['features'], shap_values_step),
+    'interaction_values': Step(['features'], interaction_values_step),
+    'shap_values_topk': Step(['shap_values'], shap_values_topk_step),
+    'shap_values_grouped': Step(['shap_values'], shap_values_grouped_step),
+    'reason_codes': Step(['shap_values_grouped'], reason_codes_step),
+    'interactions_topk': Step(['interaction_values'], interactions_topk_step),
+    'prediction': Step(['features'], prediction_step)
+}
+# used instead when the preprocessor is compiled: records are written
+# straight into features, or batches via typed columns (float32 numericals,
+# categorical codes) when `columns`, so no object array is created
+COMPILED_STEPS = {
+    'features': Step(['records'], compiled_features_step)
+}
+COLUMNS_STEPS = {
+    'columns': Step(['records'], columns_step),
+    'features': Step(['columns'], columns_features_step)
+}
+# used instead when there's no sklearn classifier (i.e. with a model bundle)
+NATIVE_STEPS = {
+    'margin': Step(['features'], native_margin_step),
+    'prediction': Step(['margin'], prediction_from_margin_step)
+}
+# used instead with 'approximate=true', for Saabas attributions: same shape
+# and sum as SHAP values, but only from the path each record follows. There
+# is no error bound: on German credit data their mean relative L1 error to
+# SHAP values was 39% (at most 72%), see `benchmark.approximation_error`
+APPROXIMATE_STEPS = {
+    'shap_values': Step(['features'], approximate_shap_values_step)
+}
+# used instead when interaction values are computed anyway, since they sum
+# to the SHAP values, which in turn sum to the margin
+SHAP_STEPS = {
+    'shap_values': Step(['interaction_values'], shap_values_from_interactions_step),
+}
+MARGIN_STEPS = {
+    'margin': Step(['shap_values'], margin_step),
+    'prediction': Step(['margin'], prediction_from_margin_step)
+}
+# used instead when interactions are restricted to 'interaction_pairs', which
+# skips paths without them (but main effects aren't computed)
+PAIRS_STEPS = {
+    'interaction_pairs': Step([], interaction_pairs_step),
+    'pair_interaction_values': Step(
+        ['features', 'interaction_pairs'], pair_interaction_values_step
+    ),
+    'interactions_topk': Step(
+        ['pair_interaction_values', 'interaction_pairs'], pair_interactions_topk_step
+    )
+}
+# entity: (step, position in the response columns)
+ENTITY_STEPS = {
+    'data': ('data', ['data']),
+    'features': ('features', ['features']),
+    'descriptions': ('descriptions', ['descriptions']),
+    'prediction': ('prediction', ['prediction']),
+    'explanation_shap_values': ('shap_values', ['explanation', 'shap_values']),
+    'explanation_shap_values_topk': (
+        'shap_values_topk', ['explanation', 'shap_values_topk']
+    ),
+    'explanation_shap_values_grouped': (
+        'shap_values_grouped', ['explanation', 'shap_values_grouped']
+    ),
+    'explanation_reason_codes': ('reason_codes', ['explanation', 'reason_codes']),
+    'explanation_shap_interaction_values': (
+        'interaction_values', ['explanation', 'shap_interaction_values']
+    ),
+    'explanation_shap_interactions_topk': (
+        'interactions_topk', ['explanation', 'shap_interactions_topk']
+    )
+}
+
+
+def plan_fn(entities, parameters, compiled=False, native=False, columns=False):
+    """
+    Plan of the steps needed for the requested entities (others are ignored).
+    Features use the compiled preprocessor if `compiled` (with typed columns
+    if `columns`), and predictions use the native trees (instead of the
+    classifier) if `native`.
+    """
+    entities = [entity for entity in entities if entity in ENTITY_STEPS]
+    targets = [ENTITY_STEPS[entity][0] for entity in entities]
+    if any(ENTITY_STEPS[entity][1][0] == 'explanation' for entity in entities):
+        targets.append('expected_value')
+    steps = dict(STEPS)
+    if compiled:
+        steps.update(COLUMNS_STEPS if columns else COMPILED_STEPS)
+    if native:
+        steps.update(NATIVE_STEPS)
+    if 'interaction_pairs' in parameters:
+        steps.update(PAIRS_STEPS)
+    approximate = parameters.get('approximate') == 'true'
+    if approximate:
+        steps.update(APPROXIMATE_STEPS)
+    plan = Plan(targets, steps)
+    # interaction values are always exact (and exact SHAP values come with
+    # them), so the flag would be silently ignored
+    interactions = 'interaction_values' in plan or 'pair_interaction_values' in plan
+    assert not (approximate and interactions), \
+        "approximate=true can't be combined with interaction values."
+    if 'interaction_values' in plan:
+        steps.update(SHAP_STEPS)
+        steps.update(MARGIN_STEPS)
+    elif 'shap_values' in plan:
+        steps.update(MARGIN_STEPS)
+    return Plan(targets, steps)
+
+
+def execute_cached(plan, context, timings=None):
+    """
+    Executes the plan, but the steps that depend on the features are only
+    computed for records that aren't in the cache, and added to it.
+    """
+    model_assets = context["model_assets"]
+    cache = model_assets["cache"]
+    cached = plan.dependents('features')
+    results = plan.execute(context, timings, skip=cached)
+    targets = [name for name in plan.targets if name in cached]
+    if not targets:
+        return results
+    features = results['features']
+    keys = caching.record_keys(
+        features, model_assets["fingerprint"], targets, context["parameters"]
+    )
+    hits = [cache.get(key) for key in keys]
+    misses = [idx for idx, hit in enumerate(hits) if hit is None]
+    if timings is not None:
+        timings.size('cache_hits', len(keys) - len(misses))
+    if misses:
+        miss_context = dict(context, records=[context["records"][idx] for idx in misses])
+        miss_results = dict(results, features=features[misses])
+        miss_results = plan.execute(miss_context, timings, results=miss_results)
+        for miss_idx, idx in enumerate(misses):
+            hits[idx] = {name: caching.take(miss_results[name], miss_idx) for name in targets}
+            cache.put(keys[idx], hits[idx])
+    for name in targets:
+        results[name] = caching.stack([hit[name] for hit in hits])
+    return results
+
+
+def predict_batch(records, entities, model_assets, parameters=None, batch=True, timings=None):
+    """
+    Computes the steps needed for the requested entities once for all records,
+    and returns columnar Predictions (that can be split into one response per
+    record, in the same order). Records of a batch that aren't valid are
+    responded to with an error, while others are still computed together.
+    """
+    parameters = parameters or {}
+    feature_names = model_assets["features_schema"].item_titles
+    columns = {}
+    predictions = Predictions(columns, feature_names, len(records), batch, timings)
+    if len(records) == 0:
+        return predictions
+    compiled = model_assets.get("compiled_preprocessor") is not None
+    native = model_assets["classifier"] is None
+    typed = len(records) >= COLUMNS_MIN_RECORDS
+    plan = plan_fn(entities, parameters, compiled, native, typed)
+    context = {'records': records, 'model_assets': model_assets, 'parameters': parameters}
+    valid_idxs = None
+    if batch and 'records' in plan:
+        errors = timing.timed(timings, 'validate', validate_records, records, model_assets)
+        context['validated'] = True
+        if any(error is not None for error in errors):
+            predictions.errors = errors
+            valid_idxs = [idx for idx, error in enumerate(errors) if error is None]
+            context['records'] = [records[idx] for idx in valid_idxs]
+            if timings is not None:
+                timings.size('invalid_records', len(records) - len(valid_idxs))
+    if len(context['records']) == 0:
+        # no valid records, so only the steps that are the same for all
+        skip = plan.dependents('records') | {'records'}
+        results = plan.execute(context, timings, skip=skip)
+    elif model_assets.get("cache") is not None and 'features' in plan:
+        results = execute_cached(plan, context, timings)
+    else:
+        results = plan.execute(context, timings)
+    for entity in entities:
+        if entity not in ENTITY_STEPS:
+            continue
+        name, path = ENTITY_STEPS[entity]
+        if name not in results:
+            continue
+        value = results[name]
+        if valid_idxs is not None and name == 'data':
+            value = [record_data(record) for record in records]
+        elif valid_idxs is not None and KEY_SEPARATOR.join(path) not in SHARED_KEYS:
+            value = scatter_rows(value, valid_idxs, len(records))
+        *parents, key = path
+        parent = columns
+        for parent_key in parents:
+            parent = parent.setdefault(parent_key, {})
+        parent[key] = value
+    if 'explanation' in columns:
+        columns['explanation']['expected_value'] = results['expected_value']
+    explanation = columns.get('explanation', {})
+    if 'shap_values_grouped' in explanation or 'reason_codes' in explanation:
+        explanation['fields'] = model_assets["field_groups"].fields
+    if 'reason_codes' in explanation:
+        explanation['reason_table'] = model_assets["reason_codes"].to_columns()
+    return predictions
+
+
+def output_fn(prediction, response_content_type):
+    accept = response_content_type.split(';')[0].strip()
     assert (
-        response_content_type == "application/json"
-    ), "accept must be 'application/json'"
-    response_body_str = json.dumps(response)
-    return response_body_str
+        accept in ACCEPT_TYPES
+    ), "accept must be one of {}".format(sorted(ACCEPT_TYPES))
+    if not isinstance(prediction, Predictions):
+        # already JSON compatible
+        return json.dumps(prediction)
+    timings = prediction.timings
+    body = timing.timed(timings, 'output_fn', serialize, prediction, accept)
+    if timings is not None:
+        timings.size('response_bytes', len(body))
+        timings.finish()
+    return body
+
+
+def serialize(prediction, accept):
+    if accept == NPZ_CONTENT_TYPE:
+        return prediction.to_npz()
+    if accept == JSONLINES_CONTENT_TYPE:
+        return prediction.to_jsonlines()
+    return prediction.to_json()
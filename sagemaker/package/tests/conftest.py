@@ -0,0 +1,176 @@
+from pathlib import Path
+import json
+import shutil
+import sys
+import numpy as np
+import pytest
+
+from package import utils
+
+current_folder = utils.get_current_folder(globals())
+src_path = Path(current_folder, "../../containers/model/src").resolve()
+sys.path.append(str(src_path))
+
+
+DATA_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "array",
+    "minItems": 7,
+    "maxItems": 7,
+    "items": [
+        {
+            "title": "contact__has_telephone",
+            "type": "boolean",
+            "description": "Customer has a registered telephone number."
+        },
+        {
+            "title": "credit__amount",
+            "type": "integer",
+            "description": "Amount of money requested as part of credit application (in EUR)."  # noqa
+        },
+        {
+            "title": "credit__duration",
+            "type": "integer",
+            "description": "Amount of time the credit is requested for (in months)."  # noqa
+        },
+        {
+            "title": "credit__purpose",
+            "type": "string",
+            "description": "Customer's reason for requiring credit."
+        },
+        {
+            "title": "finance__accounts__checking__balance",
+            "type": "string",
+            "description": "Customer's balance in their checking account."
+        },
+        {
+            "title": "personal__age",
+            "type": "integer",
+            "description": "Customer's age (in years)."
+        },
+        {
+            "title": "residence__type",
+            "type": "string",
+            "description": "Customer's type of residence."
+        }
+    ],
+    "title": "Credit Application",
+    "description": "An array of items used to describe a credit application."
+}
+
+
+LABEL_SCHEMA = {
+    "$schema": "http://json-schema.org/draft-04/schema#",
+    "type": "array",
+    "minItems": 1,
+    "maxItems": 1,
+    "items": [
+        {
+            "title": "credit__default",
+            "type": "boolean",
+            "description": "Customer defaulted on their credit."
+        }
+    ],
+    "title": "Credit Application Outcome",
+    "description": "An array of items used to describe a credit application outcome."  # noqa
+}
+
+
+CATEGORIES = {
+    "credit__purpose": ["car", "used_car", "furniture", "education", "repairs"],
+    "finance__accounts__checking__balance": ["no_account", "negative", "low", "high"],  # noqa
+    "residence__type": ["own", "rent", "free"]
+}
+
+
+def create_records(num_records, seed=0):
+    random_state = np.random.RandomState(seed)
+    records = []
+    for _ in range(num_records):
+        record = {
+            "contact__has_telephone": bool(random_state.rand() > 0.5),
+            "credit__amount": int(random_state.randint(250, 20000)),
+            "credit__duration": int(random_state.randint(4, 72)),
+            "personal__age": int(random_state.randint(19, 75)),
+        }
+        for title, categories in CATEGORIES.items():
+            record[title] = categories[random_state.randint(len(categories))]
+        records.append(record)
+    return records
+
+
+def create_labels(records, seed=0):
+    random_state = np.random.RandomState(seed)
+    labels = []
+    for record in records:
+        risk = (
+            record["credit__amount"] / 20000
+            + record["credit__duration"] / 72
+            + (record["finance__accounts__checking__balance"] == "negative")
+            - (record["residence__type"] == "own") * 0.5
+            + random_state.rand()
+        )
+        labels.append({"credit__default": bool(risk > 1.5)})
+    return labels
+
+
+def write_json_lines(records, folder):
+    folder.mkdir(exist_ok=True, parents=True)
+    with open(Path(folder, "part-00000.json"), "w") as openfile:
+        for record in records:
+            openfile.write(json.dumps(record) + "\n")
+
+
+@pytest.fixture(scope="session")
+def records():
+    return create_records(64, seed=1)
+
+
+@pytest.fixture(scope="session")
+def model_dir(tmp_path_factory):
+    import entry_point as ep
+
+    tmp_path = tmp_path_factory.mktemp("model")
+    schemas_folder = Path(tmp_path, "schemas")
+    schemas_folder.mkdir()
+    with open(Path(schemas_folder, "data.schema.json"), "w") as openfile:
+        json.dump(DATA_SCHEMA, openfile)
+    with open(Path(schemas_folder, "label.schema.json"), "w") as openfile:
+        json.dump(LABEL_SCHEMA, openfile)
+    train_records = create_records(500, seed=2)
+    test_records = create_records(100, seed=3)
+    write_json_lines(train_records, Path(tmp_path, "data_train"))
+    write_json_lines(create_labels(train_records), Path(tmp_path, "label_train"))
+    write_json_lines(test_records, Path(tmp_path, "data_test"))
+    write_json_lines(create_labels(test_records), Path(tmp_path, "label_test"))
+
+    sys_args = [
+        "--cv-splits", "1",
+        "--model-dir", str(Path(tmp_path, "model")),
+        "--schemas", str(schemas_folder),
+        "--data-train", str(Path(tmp_path, "data_train")),
+        "--label-train", str(Path(tmp_path, "label_train")),
+        "--data-test", str(Path(tmp_path, "data_test")),
+        "--label-test", str(Path(tmp_path, "label_test"))
+    ]
+    args = ep.parse_args(sys_args)
+    ep.train_fn(args)
+    return args.model_dir
+
+
+@pytest.fixture(scope="session")
+def model_assets(model_dir):
+    import entry_point as ep
+
+    return ep.model_fn(model_dir)
+
+
+@pytest.fixture(scope="session")
+def legacy_model_assets(model_dir, tmp_path_factory):
+    # same model, but without the model bundle (i.e. joblib files only)
+    import entry_point as ep
+    import bundles
+
+    legacy_model_dir = Path(tmp_path_factory.mktemp("legacy"), "model")
+    shutil.copytree(model_dir, legacy_model_dir, ignore=shutil.ignore_patterns(bundles.FILENAME))  # noqa
+    return ep.model_fn(legacy_model_dir)
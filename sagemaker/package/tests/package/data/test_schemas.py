@@ -112,7 +112,7 @@ def test_transform_list():
     data = [True, 1, 'test']
     data = schema.transform(data)
     assert isinstance(data, np.ndarray)
-    assert data.dtype == np.object
+    assert data.dtype == object
     assert data.shape == (3,)
 
 
@@ -125,8 +125,113 @@ def test_transform_dict():
     }
     data = schema.transform(data)
     assert isinstance(data, np.ndarray)
-    assert data.dtype == np.object
+    assert data.dtype == object
     assert data.shape == (3,)
     assert data[0] == True  # noqa
     assert data[1] == 1
     assert data[2] == "test"
+
+
+def test_transform_batch():
+    schema = schemas.Schema(JSON_SCHEMA)
+    data = [
+        {
+            "credit_purpose": "test",
+            "credit_amount": 1,
+            "contact_has_telephone": True
+        },
+        [False, 2, "other"]
+    ]
+    data = schema.transform_batch(data)
+    assert isinstance(data, np.ndarray)
+    assert data.dtype == object
+    assert data.shape == (2, 3)
+    assert data[0].tolist() == [True, 1, "test"]
+    assert data[1].tolist() == [False, 2, "other"]
+
+
+def test_transform_columns():
+    schema = schemas.Schema(JSON_SCHEMA)
+    data = [[True, 1, "test"], {
+        "credit_purpose": "other",
+        "credit_amount": 2,
+        "contact_has_telephone": False
+    }, [False, 3, "test"]]
+    columns = schema.transform_columns(data)
+    assert columns[0].dtype == np.float32
+    assert columns[0].tolist() == [1., 0., 0.]
+    assert columns[1].tolist() == [1., 2., 3.]
+    assert columns[2].codes.tolist() == [0, 1, 0]
+    assert columns[2].categories == ["test", "other"]
+    assert columns[2].values().tolist() == ["test", "other", "test"]
+
+
+def test_parse_rows():
+    schema = schemas.Schema(JSON_SCHEMA)
+    rows = [['true', '1', 'test'], ['False', ' 20 ', 'other']]
+    instances = schema.parse_rows(rows)
+    assert instances == [[True, 1, 'test'], [False, 20, 'other']]
+    for instance in instances:
+        schema.validate(instance)
+
+
+def test_parse_rows_wrong_types():
+    schema = schemas.Schema(JSON_SCHEMA)
+    with pytest.raises(ValueError):
+        schema.parse_rows([['true', '1.5', 'test']])
+    with pytest.raises(ValueError):
+        schema.parse_rows([['yes', '1', 'test']])
+    with pytest.raises(ValueError):
+        schema.parse_rows([['true', '1']])
+
+
+def test_validate_compiled_checks_match_jsonschema():
+    schema = schemas.Schema(JSON_SCHEMA)
+    values = [True, False, 0, 1, 1.5, 'test', None, [], {}]
+    titles = schema.item_titles
+    for a in values:
+        for b in values:
+            for instance in ([a, b, 'test'], dict(zip(titles, [True, a, b]))):
+                try:
+                    schema._validate_jsonschema(instance)
+                    expected = True
+                except ValidationError:
+                    expected = False
+                if schema._is_valid(instance):
+                    assert expected
+                try:
+                    schema.validate(instance)
+                    assert expected
+                except ValidationError:
+                    assert not expected
+
+
+def test_validate_compiled_checks_fallback():
+    json_schema = dict(JSON_SCHEMA, items=[
+        dict(JSON_SCHEMA['items'][0]),
+        dict(JSON_SCHEMA['items'][1], minimum=0),
+        dict(JSON_SCHEMA['items'][2])
+    ])
+    schema = schemas.Schema(json_schema)
+    assert not schema._is_valid([True, 1, 'test'])
+    schema.validate([True, 1, 'test'])
+    with pytest.raises(ValidationError):
+        schema.validate([True, -1, 'test'])
+
+
+def test_validate_batch():
+    schema = schemas.Schema(JSON_SCHEMA)
+    instances = [
+        [True, 1, 'test'],
+        {"contact_has_telephone": True, "credit_amount": 1, "credit_purpose": "test"},
+        {"contact_has_telephone": True, "credit_amount": True, "credit_purpose": "test"},
+        [True, 1],
+        'test',
+        {"contact_has_telephone": True, "credit_amount": 1},
+        [True, 1, np.str_('test')]  # not exactly a str, but valid for jsonschema
+    ]
+    errors = schema.validate_batch(instances)
+    assert [error is None for error in errors] == [True, True, False, False, False, False, True]  # noqa
+    assert isinstance(errors[2], ValidationError)
+    assert isinstance(errors[4], ValidationError)
+    assert schema.validate_batch([]) == []
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+import time
+import numpy as np
+
+import batching
+import explaining
+
+
+class Recorder:
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, key, requests):
+        with self.lock:
+            self.batches.append((key, [len(r) for r in requests]))
+        time.sleep(self.delay)
+        for request in requests:
+            if 'bad' in request:
+                raise ValueError('bad record')
+        return [[(key, record) for record in request] for request in requests]
+
+
+def test_coalescer_concurrent():
+    recorder = Recorder(delay=0.01)
+    coalescer = batching.Coalescer(recorder, max_batch_size=8, max_wait_ms=5)
+    requests = [(idx % 2, [idx, idx + 100]) for idx in range(40)]
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        results = list(executor.map(lambda r: coalescer.submit(*r), requests))
+    for (key, records), result in zip(requests, results):
+        assert result == [(key, record) for record in records]
+    sizes = [sum(sizes) for _, sizes in recorder.batches]
+    assert max(sizes) <= 8
+    assert len(recorder.batches) < len(requests)
+
+
+def test_coalescer_single_request_doesnt_wait():
+    coalescer = batching.Coalescer(Recorder(), max_batch_size=8, max_wait_ms=1000)
+    start = time.monotonic()
+    assert coalescer.submit('key', [1]) == [('key', 1)]
+    assert time.monotonic() - start < 0.5
+
+
+def test_coalescer_error_isolation():
+    recorder = Recorder(delay=0.01)
+    coalescer = batching.Coalescer(recorder, max_batch_size=8, max_wait_ms=5)
+    requests = [[1], ['bad'], [2], [3]]
+
+    def submit(records):
+        try:
+            return coalescer.submit('key', records)
+        except ValueError as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(submit, requests))
+    assert isinstance(results[1], ValueError)
+    assert [results[0], results[2], results[3]] == [[('key', 1)], [('key', 2)], [('key', 3)]]  # noqa
+
+
+def predict(request, model_assets):
+    records = explaining.predict_fn(request, model_assets).records()
+    if request['batch']:
+        return records
+    return records[0]
+
+
+def test_predict_fn_coalesced(records, model_assets):
+    entities = ['prediction', 'explanation_shap_values', 'descriptions']
+    requests = [
+        {'data': record, 'entities': entities, 'batch': False}
+        for record in records[:16]
+    ] + [{'data': records[16:20], 'entities': entities, 'batch': True}]
+    expected = [predict(r, model_assets) for r in requests]
+    coalesced_model_assets = dict(model_assets)
+    coalesced_model_assets["coalescer"] = batching.Coalescer(
+        functools.partial(explaining.predict_requests, model_assets=model_assets),  # noqa
+        max_batch_size=8
+    )
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(
+            lambda r: predict(r, coalesced_model_assets), requests
+        ))
+    assert len(responses[-1]) == 4
+    # last request is a batch (of 4 records)
+    responses = responses[:-1] + responses[-1]
+    expected = expected[:-1] + expected[-1]
+    for response, expected_response in zip(responses, expected):
+        assert response.keys() == expected_response.keys()
+        assert response['descriptions'] == expected_response['descriptions']
+        assert np.isclose(response['prediction'], expected_response['prediction'])  # noqa
+        np.testing.assert_allclose(
+            list(response['explanation']['shap_values'].values()),
+            list(expected_response['explanation']['shap_values'].values()),
+            atol=1e-6
+        )
@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+
+import benchmark
+
+
+def test_record_generator(model_assets):
+    generator = benchmark.RecordGenerator(
+        model_assets["data_schema"], model_assets["features_schema"]
+    )
+    records = generator.records(20)
+    for record in records:
+        model_assets["data_schema"].validate(record)
+    assert set(r["credit__purpose"] for r in records) <= set(
+        ["car", "used_car", "furniture", "education", "repairs"]
+    )
+
+
+def test_fixed_rate():
+    latencies, duration = benchmark.fixed_rate(lambda body: body, ["a"] * 10, rate=100)  # noqa
+    assert all(latency is not None for latency in latencies)
+    assert duration >= 0.09
+    summary = benchmark.summarize(latencies + [None], duration)
+    assert summary["requests"] == 11 and summary["errors"] == 1
+    assert summary["latency_ms"]["p99"] >= summary["latency_ms"]["p50"]
+
+
+def test_main(model_dir, tmp_path):
+    output = Path(tmp_path, "report.json")
+    benchmark.main([
+        "--model-dir", str(model_dir),
+        "--requests", "20",
+        "--concurrency", "2",
+        "--output", str(output)
+    ])
+    report = json.loads(output.read_text())
+    assert [r["entities"] for r in report["results"]] == [
+        e.split(",") for e in benchmark.DEFAULT_ENTITIES
+    ]
+    for result in report["results"]:
+        assert result["requests"] == 20 and result["errors"] == 0
+        assert result["throughput_rps"] > 0
+
+
+def test_main_approximation_error(model_dir, tmp_path):
+    output = Path(tmp_path, "approximation.json")
+    benchmark.main([
+        "--model-dir", str(model_dir),
+        "--approximation-error", str(Path(model_dir).parent / "data_test"),
+        "--output", str(output)
+    ])
+    report = json.loads(output.read_text())
+    assert report["records"] == 100
+    assert 0 <= report["relative_l1_error"]["mean"] <= report["relative_l1_error"]["max"]
+    assert 0 <= report["topk_overlap"] <= 1
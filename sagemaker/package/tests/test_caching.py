@@ -0,0 +1,59 @@
+import numpy as np
+
+import caching
+import explaining
+
+
+ENTITIES = [
+    'prediction',
+    'explanation_shap_values',
+    'explanation_shap_interactions_topk'
+]
+
+
+def test_lru_cache_max_entries():
+    cache = caching.LRUCache(max_entries=2)
+    cache.put('a', np.zeros(1))
+    cache.put('b', np.zeros(1))
+    assert cache.get('a') is not None  # 'b' is now least recently used
+    cache.put('c', np.zeros(1))
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+    assert cache.counters() == {
+        'hits': 2, 'misses': 1, 'evictions': 1, 'entries': 2, 'bytes': 16
+    }
+
+
+def test_lru_cache_max_bytes():
+    cache = caching.LRUCache(max_bytes=100)
+    for key in range(5):
+        cache.put(key, {'values': np.zeros(4)})  # 32 bytes
+    assert len(cache) == 3
+    assert cache.counters()['bytes'] == 96
+    assert cache.get(0) is None and cache.get(4) is not None
+
+
+def test_record_keys():
+    features = np.array([[0., 1.], [0., 1.], [1., 0.]])
+    keys = caching.record_keys(features, 'model', ['prediction'], {})
+    assert keys[0] == keys[1] != keys[2]
+    assert keys[0] != caching.record_keys(features, 'other', ['prediction'], {})[0]  # noqa
+    assert keys[0] != caching.record_keys(features, 'model', ['shap_values'], {})[0]  # noqa
+
+
+def test_predict_fn_cached(records, model_assets):
+    cache = caching.LRUCache(max_entries=1000)
+    cached_model_assets = dict(model_assets, cache=cache, fingerprint='model')
+    request = {'data': records[:8], 'entities': ENTITIES, 'batch': True}
+    expected = explaining.predict_fn(request, model_assets).records()
+    assert explaining.predict_fn(request, cached_model_assets).records() == expected  # noqa
+    assert cache.counters()['misses'] == 8
+    # partially cached (and out of order) batch
+    request['data'] = records[4:12][::-1]
+    responses = explaining.predict_fn(request, cached_model_assets).records()
+    assert cache.counters()['hits'] == 4
+    assert responses[4:] == expected[4:][::-1]
+    # a different request isn't served from the same entries
+    request = {'data': records[:8], 'entities': ['prediction'], 'batch': True}
+    explaining.predict_fn(request, cached_model_assets)
+    assert cache.counters()['hits'] == 4
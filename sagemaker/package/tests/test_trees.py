@@ -0,0 +1,191 @@
+import joblib
+from pathlib import Path
+import numpy as np
+import pytest
+
+from trees import TreeEnsemble
+
+shap = pytest.importorskip("shap")
+lightgbm = pytest.importorskip("lightgbm")
+
+
+@pytest.fixture(scope="module")
+def features(records, legacy_model_assets):
+    data = legacy_model_assets["data_schema"].transform_batch(records)
+    return legacy_model_assets["preprocessor"].transform(data)
+
+
+@pytest.fixture(scope="module")
+def classifier(model_dir):
+    return joblib.load(Path(model_dir, "classifier.joblib"))
+
+
+def shap_explainer(classifier):
+    explainer = shap.TreeExplainer(classifier)
+    expected_value = np.array(explainer.expected_value).reshape(-1)[-1]
+    return explainer, expected_value
+
+
+def positive_class(shap_values):
+    if isinstance(shap_values, list):
+        return shap_values[1]
+    return shap_values
+
+
+def test_expected_value(classifier):
+    trees = TreeEnsemble.from_classifier(classifier)
+    explainer, expected_value = shap_explainer(classifier)
+    assert np.isclose(trees.expected_value, expected_value)
+
+
+def test_predict_margin(classifier, features):
+    trees = TreeEnsemble.from_classifier(classifier)
+    margins = classifier.predict_proba(features, raw_score=True)
+    np.testing.assert_allclose(trees.predict_margin(features), margins, atol=1e-9)  # noqa
+
+
+def test_shap_values(classifier, features):
+    trees = TreeEnsemble.from_classifier(classifier)
+    explainer, expected_value = shap_explainer(classifier)
+    expected = positive_class(explainer.shap_values(features))
+    shap_values = trees.shap_values(features)
+    assert shap_values.shape == expected.shape
+    np.testing.assert_allclose(shap_values, expected, atol=1e-9)
+
+
+def test_shap_interaction_values(classifier, features):
+    trees = TreeEnsemble.from_classifier(classifier)
+    explainer, expected_value = shap_explainer(classifier)
+    expected = positive_class(explainer.shap_interaction_values(features))
+    interaction_values = trees.shap_interaction_values(features)
+    assert interaction_values.shape == expected.shape
+    np.testing.assert_allclose(interaction_values, expected, atol=1e-9)
+
+
+@pytest.mark.parametrize("boosting_type", ["gbdt", "dart"])
+def test_deep_trees(boosting_type):
+    random_state = np.random.RandomState(0)
+    X = random_state.rand(500, 12)
+    X[:, 5:] = X[:, 5:] > 0.5  # one-hot like features
+    y = X[:, 0] + X[:, 5] * X[:, 1] + random_state.rand(500) * 0.5 > 1
+    classifier = lightgbm.LGBMClassifier(
+        boosting_type=boosting_type,
+        max_depth=10,
+        num_leaves=31,
+        min_child_samples=5,
+        n_estimators=50,
+        verbose=-1
+    )
+    classifier.fit(X, y.astype(int))
+    trees = TreeEnsemble.from_classifier(classifier)
+    explainer, expected_value = shap_explainer(classifier)
+    X = X[:50]
+    np.testing.assert_allclose(
+        trees.shap_values(X),
+        positive_class(explainer.shap_values(X)),
+        atol=1e-9
+    )
+    np.testing.assert_allclose(
+        trees.shap_interaction_values(X),
+        positive_class(explainer.shap_interaction_values(X)),
+        atol=1e-9
+    )
+
+
+def test_local_accuracy_with_missing_values():
+    random_state = np.random.RandomState(1)
+    X = random_state.rand(500, 4)
+    y = (X[:, 0] + X[:, 1] > 1).astype(int)
+    X[random_state.rand(500, 4) > 0.8] = np.nan
+    classifier = lightgbm.LGBMClassifier(n_estimators=20, verbose=-1)
+    classifier.fit(X, y)
+    trees = TreeEnsemble.from_classifier(classifier)
+    margins = classifier.predict_proba(X, raw_score=True)
+    np.testing.assert_allclose(trees.predict_margin(X), margins, atol=1e-9)
+    np.testing.assert_allclose(
+        trees.shap_values(X).sum(axis=1) + trees.expected_value,
+        margins,
+        atol=1e-9
+    )
+
+
+def saabas_values(classifier, features):
+    """
+    Reference Saabas attributions, following each row down each tree.
+    """
+    def expectation(node):
+        if "leaf_value" in node:
+            return node["leaf_value"], node.get("leaf_count", 1)
+        left, left_count = expectation(node["left_child"])
+        right, right_count = expectation(node["right_child"])
+        count = left_count + right_count
+        return (left * left_count + right * right_count) / count, count
+
+    dump = classifier.booster_.dump_model()
+    phi = np.zeros(features.shape)
+    for row, x in zip(phi, features):
+        for tree_info in dump["tree_info"]:
+            node = tree_info["tree_structure"]
+            while "leaf_value" not in node:
+                go_left = x[node["split_feature"]] <= node["threshold"]
+                child = node["left_child"] if go_left else node["right_child"]
+                row[node["split_feature"]] += expectation(child)[0] - expectation(node)[0]  # noqa
+                node = child
+    return phi
+
+
+def test_approximate_shap_values(classifier, features):
+    trees = TreeEnsemble.from_classifier(classifier)
+    approximate_values = trees.approximate_shap_values(features)
+    np.testing.assert_allclose(approximate_values, saabas_values(classifier, features), atol=1e-9)  # noqa
+    margins = classifier.predict_proba(features, raw_score=True)
+    np.testing.assert_allclose(
+        approximate_values.sum(axis=1) + trees.expected_value, margins, atol=1e-9
+    )
+    arrays, constants = trees.to_arrays()
+    del arrays["slot_delta"]
+    loaded = TreeEnsemble.from_arrays(arrays, constants)
+    np.testing.assert_allclose(loaded.approximate_shap_values(features), approximate_values)  # noqa
+
+
+def test_sparse_preprocessor(records, legacy_model_assets):
+    # OneHotEncoder with sparse output, so the preprocessor isn't compiled
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import OneHotEncoder
+
+    import explaining
+    from explainers import Explainer
+
+    data_schema = legacy_model_assets["data_schema"]
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ("categorical", OneHotEncoder(handle_unknown="ignore"), [3, 4, 6]),
+            ("numerical", "passthrough", [1, 2, 5])
+        ],
+        sparse_threshold=1.
+    )
+    features = preprocessor.fit_transform(data_schema.transform_batch(records))
+    assert hasattr(features, "toarray")
+    labels = np.random.RandomState(0).randint(0, 2, len(records))
+    classifier = lightgbm.LGBMClassifier(n_estimators=10, min_child_samples=2, verbose=-1)
+    classifier.fit(features, labels)
+    trees = TreeEnsemble.from_classifier(classifier)
+    np.testing.assert_allclose(trees.shap_values(features), trees.shap_values(features.toarray()))  # noqa
+    np.testing.assert_allclose(trees.predict_margin(features), classifier.predict_proba(features, raw_score=True), atol=1e-9)  # noqa
+    model_assets = dict(
+        legacy_model_assets,
+        preprocessor=preprocessor,
+        compiled_preprocessor=None,
+        classifier=classifier,
+        explainer=Explainer(classifier),
+        cache=None,
+        coalescer=None
+    )
+    request = {
+        'data': records[:4],
+        'entities': ['features', 'prediction', 'explanation_shap_values'],
+        'batch': True
+    }
+    columns = explaining.predict_fn(request, model_assets).columns
+    np.testing.assert_allclose(columns['features'], features[:4].toarray())
+    assert columns['explanation']['shap_values'].shape == (4, features.shape[1])
@@ -0,0 +1,161 @@
+"""
+MODELS: multi-model hosting, where the model directory contains one folder
+per model (e.g. from different `train_fn` runs) and each request names its
+model, with 'model=<id>' in the content type.
+
+Model assets are loaded on demand into an LRU keyed by model id, and least
+recently used models are unloaded when the loaded models take more than a
+memory budget (estimated by the size of their files). A model is loaded
+outside of the registry's lock, so requests for loaded models don't wait
+for it (requests for the same model do, and it's only loaded once).
+
+Disabled unless the MULTI_MODEL environment variable is set to 'true'.
+MODELS_MAX_BYTES sets the memory budget (unlimited if not set). Caches of
+results (see `caching.py`) aren't counted in it: each loaded model has its
+own cache, so they can take up to CACHE_BYTES per loaded model on top.
+"""
+from collections import OrderedDict
+import os
+from pathlib import Path
+import re
+import threading
+import time
+
+import bundles
+
+
+MODEL_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+def enabled():
+    return os.environ.get("MULTI_MODEL", "false").lower() == "true"
+
+
+def from_environment(models_dir, load_fn, unload_fn=None):
+    max_bytes = os.environ.get("MODELS_MAX_BYTES")
+    return ModelRegistry(
+        models_dir, load_fn, unload_fn, max_bytes=int(max_bytes) if max_bytes else None
+    )
+
+
+def model_bytes(model_dir):
+    """
+    Size of the files that loading uses, as an estimate of the memory they
+    take once loaded: the model bundle when there's one (memory mapped as a
+    whole), or else the joblib files (see `explaining.load_model`). Training
+    writes both, but only one of them is loaded.
+    """
+    bundle_path = Path(model_dir, bundles.FILENAME)
+    filepaths = [bundle_path] if bundle_path.exists() else Path(model_dir).glob("*.joblib")
+    return sum(filepath.stat().st_size for filepath in filepaths)
+
+
+class Loading:
+    def __init__(self):
+        self.event = threading.Event()
+        self.model_assets = None
+        self.error = None
+
+
+class ModelRegistry:
+    """
+    Model assets by model id (a folder of `models_dir`), loaded with
+    `load_fn(model_dir)` and, when evicted, passed to `unload_fn` (e.g. to
+    stop their threads). Safe to share between threads.
+    """
+    def __init__(self, models_dir, load_fn, unload_fn=None, max_bytes=None):
+        self.models_dir = Path(models_dir)
+        self.load_fn = load_fn
+        self.unload_fn = unload_fn
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()  # model id: (model assets, bytes)
+        self._loading = {}  # model id: Loading
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.load_errors = 0
+        self.evictions = 0
+        self.load_seconds = 0.
+
+    def __contains__(self, model_id):
+        with self._lock:
+            return model_id in self._models
+
+    def model_dir(self, model_id):
+        assert isinstance(model_id, str) and MODEL_ID_PATTERN.fullmatch(model_id), \
+            "Invalid model id '{}'.".format(model_id)
+        model_dir = Path(self.models_dir, model_id)
+        assert model_dir.is_dir(), "Unknown model '{}'.".format(model_id)
+        return model_dir
+
+    def get(self, model_id):
+        with self._lock:
+            if model_id in self._models:
+                self._models.move_to_end(model_id)
+                self.hits += 1
+                return self._models[model_id][0]
+            loading = self._loading.get(model_id)
+            owner = loading is None
+            if owner:
+                loading = self._loading[model_id] = Loading()
+        if not owner:
+            # another request is loading the same model
+            loading.event.wait()
+            if loading.error is not None:
+                raise loading.error
+            return loading.model_assets
+        try:
+            model_dir = self.model_dir(model_id)
+            start = time.perf_counter()
+            model_assets = self.load_fn(model_dir)
+            duration = time.perf_counter() - start
+            size = model_bytes(model_dir)
+        except Exception as error:
+            with self._lock:
+                self.load_errors += 1
+                del self._loading[model_id]
+            loading.error = error
+            loading.event.set()
+            raise
+        evicted = self._add(model_id, model_assets, size, duration)
+        loading.model_assets = model_assets
+        loading.event.set()
+        for model_assets in evicted:
+            if self.unload_fn is not None:
+                self.unload_fn(model_assets)
+        return loading.model_assets
+
+    def _add(self, model_id, model_assets, size, duration):
+        """
+        Adds a loaded model, and returns the model assets of evicted models
+        (the most recently loaded model itself is never evicted).
+        """
+        evicted = []
+        with self._lock:
+            del self._loading[model_id]
+            self._models[model_id] = (model_assets, size)
+            self._bytes += size
+            self.loads += 1
+            self.load_seconds += duration
+            while len(self._models) > 1 and self._over_budget():
+                _, (evicted_assets, evicted_size) = self._models.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                evicted.append(evicted_assets)
+        return evicted
+
+    def _over_budget(self):
+        return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    def counters(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'loads': self.loads,
+                'load_errors': self.load_errors,
+                'load_seconds': round(self.load_seconds, 3),
+                'evictions': self.evictions,
+                'models': list(self._models),
+                'bytes': self._bytes
+            }
@@ -0,0 +1,67 @@
+"""
+PLANNING: resolves the intermediate results (validated data, features,
+SHAP values, etc.) needed for a request, so that each one is computed at
+most once, and only when needed.
+"""
+from collections import namedtuple
+
+from timing import timed
+
+
+# `function` is called with the execution context (a dict) and the results
+# of the steps it `requires` (as keyword arguments, by step name)
+Step = namedtuple('Step', ['requires', 'function'])
+
+
+class Plan:
+    """
+    Steps needed to compute `targets`, ordered so that every step comes
+    after the steps it requires. `steps` maps step names to Steps.
+    """
+    def __init__(self, targets, steps):
+        self.steps = steps
+        self.targets = list(targets)
+        self.order = []
+        for target in self.targets:
+            self._visit(target, ())
+
+    def _visit(self, name, path):
+        assert name not in path, "Circular dependency on '{}'.".format(name)
+        assert name in self.steps, "Unknown step '{}'.".format(name)
+        if name in self.order:
+            return
+        for requirement in self.steps[name].requires:
+            self._visit(requirement, path + (name,))
+        self.order.append(name)
+
+    def __contains__(self, name):
+        return name in self.order
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def dependents(self, name):
+        """
+        Steps of the plan that require `name`, directly or indirectly.
+        """
+        dependents = set()
+        for step_name in self.order:
+            requires = self.steps[step_name].requires
+            if name in requires or dependents.intersection(requires):
+                dependents.add(step_name)
+        return dependents
+
+    def execute(self, context, timings=None, results=None, skip=()):
+        """
+        Results of all steps, by name. Steps already in `results`, or in
+        `skip`, aren't computed. Each step is timed as a stage (with the same
+        name) when `timings` are given.
+        """
+        results = dict(results or {})
+        for name in self.order:
+            if name in results or name in skip:
+                continue
+            step = self.steps[name]
+            inputs = {requirement: results[requirement] for requirement in step.requires}
+            results[name] = timed(timings, name, step.function, context, **inputs)
+        return results
@@ -0,0 +1,250 @@
+"""
+SERVING: local stand-in for the model server of the SageMaker container,
+used to load test and profile the deployment functions without SageMaker.
+
+Follows the container contract: GET /ping for health checks, and POST
+/invocations with the request body, the Content-Type header (passed to
+`input_fn`) and the Accept header (passed to `output_fn`). The model is
+loaded once (with `model_fn`) before forking worker processes, and each
+worker handles connections with a pool of threads.
+
+Workers share the model's memory copy-on-write. Garbage collection is
+disabled while loading, and loaded objects are frozen before forking, so
+collections in workers don't write to the shared pages. Large arrays
+(e.g. the memory mapped model bundle) are only touched through their
+headers, so reference counting dirties few pages either.
+
+    python serving.py --model-dir ./model --workers 2 --threads 8
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import gc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import signal
+import sys
+import traceback
+
+from jsonschema.exceptions import ValidationError
+
+import entry_point as ep
+from responses import error_object
+import timing
+
+
+DEFAULT_ACCEPT = "application/json"
+TARGET_MODEL_HEADER = "X-Amzn-SageMaker-Target-Model"
+
+
+class InvocationsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/ping":
+            self._respond(200, b"")
+        else:
+            self._respond(404, b"Not found.")
+
+    def do_POST(self):
+        if self.path != "/invocations":
+            self._respond(404, b"Not found.")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        content_type = self.headers.get("Content-Type", "application/json")
+        # model of multi-model endpoints (see `models.py`)
+        target_model = self.headers.get(TARGET_MODEL_HEADER)
+        if target_model:
+            content_type += "; model={}".format(target_model)
+        accept = self.headers.get("Accept", DEFAULT_ACCEPT)
+        if accept in ("", "*/*"):
+            accept = DEFAULT_ACCEPT
+        try:
+            model_assets = self.server.model_assets
+            request = ep.input_fn(body, content_type)
+            prediction = ep.predict_fn(request, model_assets)
+            response = ep.output_fn(prediction, accept)
+        except (AssertionError, ValueError, ValidationError) as error:
+            # assertions validate requests (see `explaining.py`), value errors
+            # come from malformed bodies (e.g. JSON or CSV values), and
+            # validation errors from records that don't fit the data schema
+            self._respond(400, error_object(error)["message"].encode("utf-8"))
+            return
+        except Exception:
+            traceback.print_exc()
+            self._respond(500, b"Internal server error.")
+            return
+        headers = {"Content-Type": accept.split(";")[0].strip()}
+        timings = getattr(prediction, "timings", None)
+        if timings is not None:
+            headers[timing.HEADER] = timings.header()
+        if isinstance(response, str):
+            response = response.encode("utf-8")
+        self._respond(200, response, headers)
+
+    def _respond(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class ModelServer(HTTPServer):
+    """
+    HTTP server that handles connections with a pool of `threads` threads,
+    and serves `model_assets` (from `model_fn`).
+    """
+    daemon_threads = True
+
+    def __init__(self, address, model_assets, threads=8, verbose=False):
+        super().__init__(address, InvocationsHandler)
+        self.model_assets = model_assets
+        self.threads = threads
+        self.verbose = verbose
+        self._executor = None
+
+    def process_request(self, request, client_address):
+        # the pool is created lazily, since threads don't survive a fork
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def freeze():
+    """
+    Moves all objects (e.g. the model assets) to a permanent generation that
+    garbage collections ignore, so forked processes keep sharing their pages.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def memory_usage(pid="self"):
+    """
+    Resident (rss), proportional (pss, i.e. shared pages divided between
+    processes) and unique (uss) memory of a process, in bytes. None when
+    not available (i.e. not on Linux).
+    """
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as openfile:
+            lines = openfile.readlines()[1:]
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, value = line.split(":")
+        values[key] = int(value.split()[0]) * 1024
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"]
+    }
+
+
+def serve(server, workers=1):
+    """
+    Serves forever from `workers` processes that share the server's socket
+    (forked from this one), or from this process when `workers` is 1.
+    """
+    if workers <= 1:
+        server.serve_forever()
+        return
+    freeze()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            gc.enable()
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for child in children:
+            if server.verbose:
+                print("Worker {} memory: {}".format(child, memory_usage(child)), flush=True)
+            os.kill(child, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for child in children:
+        os.waitpid(child, 0)
+    server.server_close()
+
+
+def parse_args(sys_args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default=os.environ.get("SM_MODEL_DIR", "/opt/ml/model")
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="0.0.0.0"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.environ.get("SAGEMAKER_BIND_TO_PORT", 8080))
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true"
+    )
+
+    args, _ = parser.parse_known_args(sys_args)
+    return args
+
+
+def main(sys_args):
+    args = parse_args(sys_args)
+    if args.workers > 1:
+        # so loading doesn't leave freed memory in the pages workers share
+        gc.disable()
+    model_assets = ep.model_fn(args.model_dir)
+    server = ModelServer(
+        (args.host, args.port), model_assets, args.threads, args.verbose
+    )
+    print("Serving {} on {}:{} ({} workers, {} threads each)".format(
+        args.model_dir, args.host, server.server_port, args.workers, args.threads
+    ), flush=True)
+    serve(server, args.workers)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -8,7 +8,6 @@ import joblib
 from lightgbm import LGBMClassifier
 import os
 from pathlib import Path
-from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder
@@ -16,20 +15,18 @@ from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import cross_val_score
 
 from package.data import schemas, datasets
+# AsTypeFloat32 is also imported here for preprocessors pickled with it
+from estimators import AsTypeFloat32
+from preprocessing import CompiledPreprocessor
+from trees import TreeEnsemble
+import bundles
+import reasons
 
 
 NUMERICAL_TYPES = set(["boolean", "integer", "number"])
 CATEGORICAL_TYPES = set(["string"])
 
 
-class AsTypeFloat32(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
-
-    def transform(self, X):
-        return X.astype("float32")
-
-
 def get_numerical_idxs(data_schema):
     idxs = get_idxs(data_schema, NUMERICAL_TYPES)
     return idxs
@@ -226,9 +223,9 @@ def parse_args(sys_args):
 def train_fn(args):
     # # load data
     data_schema, label_schema = load_schemas(args.schemas)
-    X_train = datasets.read_json_dataset(args.data_train, data_schema)
+    records_train = datasets.read_json_records(args.data_train)
     y_train = datasets.read_json_dataset(args.label_train, label_schema)
-    X_test = datasets.read_json_dataset(args.data_test, data_schema)
+    records_test = datasets.read_json_records(args.data_test)
     y_test = datasets.read_json_dataset(args.label_test, label_schema)
 
     # convert from column vector to 1d array of int
@@ -249,9 +246,32 @@ def train_fn(args):
     pipeline = Pipeline(
         [("preprocessor", preprocessor), ("classifier", classifier)]
     )
-    train_pipeline(pipeline, X_train, y_train, args.cv_splits)
+    # cross validate the whole pipeline, so that categories are only found
+    # in the training folds of each split (i.e. no leak into the estimate)
+    X_train = data_schema.transform_batch(records_train)
+    if args.cv_splits > 1:
+        log_cross_val_auc(pipeline, X_train, y_train, args.cv_splits, 'train')
+    # fit preprocessor to all training data (i.e. find categories), and when
+    # it can be compiled, train the classifier on float32 features from typed
+    # columns, instead of passing object arrays through the ColumnTransformer
+    preprocessor.fit(X_train)
+    compiled_preprocessor = CompiledPreprocessor.from_preprocessor(preprocessor, data_schema)  # noqa
+    if compiled_preprocessor is not None:
+        del X_train
+        features_train = compiled_preprocessor.transform_columns(
+            data_schema.transform_columns(records_train)
+        )
+        # already cross validated (as a pipeline) above
+        train_pipeline(classifier, features_train, y_train, cv_splits=1)
+        features_test = compiled_preprocessor.transform_columns(
+            data_schema.transform_columns(records_test)
+        )
+        test_pipeline(classifier, features_test, y_test)
+    else:
+        train_pipeline(pipeline, X_train, y_train, cv_splits=1)
+        X_test = data_schema.transform_batch(records_test)
+        test_pipeline(pipeline, X_test, y_test)
     features_schema = transform_schema(preprocessor, data_schema)
-    test_pipeline(pipeline, X_test, y_test)
 
     # save components
     model_dir = Path(args.model_dir)
@@ -260,3 +280,15 @@ def train_fn(args):
     joblib.dump(classifier, Path(model_dir, "classifier.joblib"))
     data_schema.save(Path(model_dir, "data.schema.json"))
     features_schema.save(Path(model_dir, "features.schema.json"))
+    # reason codes of each data field (can be edited to reword the reasons)
+    reasons.save_table(reasons.create_table(data_schema), Path(model_dir, reasons.FILENAME))  # noqa
+    # single file with everything needed for serving (see `bundles.py`),
+    # unless the preprocessor can't be compiled (then joblib files are used)
+    if compiled_preprocessor is not None:
+        bundles.save_model_bundle(
+            Path(model_dir, bundles.FILENAME),
+            data_schema,
+            features_schema,
+            compiled_preprocessor,
+            TreeEnsemble.from_classifier(classifier)
+        )
@@ -0,0 +1,607 @@
+"""
+TREE SHAP: exact (path dependent) SHAP values for LightGBM tree ensembles,
+computed with vectorized NumPy operations over flattened tree arrays.
+
+Every root-to-leaf path is compiled into 'slots', one per unique split
+feature on the path, and paths with the same number of slots are grouped.
+For a given input, each slot has a 'one fraction' `o` (1.0 if the input
+follows the path on all splits on that feature, otherwise 0.0) and a 'zero
+fraction' `z` (the share of training samples, i.e. cover, that follows the
+path on those splits). The SHAP value of a feature on a path only depends on
+the polynomial
+
+    P(t) = prod_s (z_s + o_s * t)
+
+which is computed for all rows and leaves of a group at once. Removing one
+factor from P(t) gives the SHAP values, and removing two gives the
+interaction values.
+
+Approximate (Saabas) attributions only need the path each input reaches:
+every split on it attributes the change in expected leaf value (i.e. the
+cover weighted mean of the leaves below) to its feature, which is
+precomputed per slot.
+See Lundberg et al. (2020) 'From local explanations to global understanding
+with explainable AI for trees' and Mitchell et al. (2022) 'GPUTreeShap'.
+"""
+from collections import namedtuple
+from math import factorial
+
+import numpy as np
+
+
+MISSING_TYPES = {"None": 0, "Zero": 1, "NaN": 2}
+ZERO_THRESHOLD = 1e-35
+# number of float64 elements per working array, used to split rows in chunks
+CHUNK_ELEMENTS = 2 ** 22
+
+
+PathGroup = namedtuple("PathGroup", [
+    "depth",
+    "leaf_value",
+    "leaf_cover_fraction",
+    "slot_feature",
+    "slot_zero",
+    "slots",
+    "weights",
+    "pair_weights"
+])
+
+
+def shapley_weights(depth):
+    """
+    Shapley weights k!(d-k-1)!/d! for subsets of size k = 0, ..., d - 1,
+    when there are d features on the path.
+    """
+    weights = [
+        factorial(k) * factorial(depth - k - 1) / factorial(depth)
+        for k in range(max(depth, 0))
+    ]
+    return np.array(weights)
+
+
+def as_array(X):
+    """
+    Float64 array of X, densifying scipy sparse matrices (e.g. features of
+    a sparse OneHotEncoder, for preprocessors that can't be compiled).
+    """
+    if hasattr(X, "toarray"):
+        X = X.toarray()
+    return np.asarray(X, dtype=np.float64)
+
+
+class TreeEnsemble:
+    """
+    Flattened LightGBM binary classifier, used to compute the raw (log-odds)
+    margin and exact SHAP (interaction) values for a batch of rows.
+
+    Node arrays (`feature`, `threshold`, `left`, `right`, `cover`, `value`,
+    `default_left` and `missing_type`) hold the nodes of all trees, with
+    indices that are global across trees. Leaves have `feature == -1`.
+    """
+    def __init__(
+        self,
+        feature,
+        threshold,
+        left,
+        right,
+        cover,
+        value,
+        default_left,
+        missing_type,
+        roots,
+        num_features,
+        sigmoid=1.0
+    ):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.cover = np.asarray(cover, dtype=np.float64)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.missing_type = np.asarray(missing_type, dtype=np.int8)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.num_features = int(num_features)
+        self.sigmoid = float(sigmoid)
+        self._compile_paths()
+
+    @classmethod
+    def from_booster(cls, booster):
+        dump = booster.dump_model()
+        if dump["num_tree_per_iteration"] != 1:
+            raise ValueError("Only binary classifiers are supported.")
+        # random forest mode averages trees, instead of summing them
+        scale = 1.0
+        if dump.get("average_output", False):
+            scale = 1.0 / max(len(dump["tree_info"]), 1)
+        nodes = {
+            "feature": [],
+            "threshold": [],
+            "left": [],
+            "right": [],
+            "cover": [],
+            "value": [],
+            "default_left": [],
+            "missing_type": []
+        }
+        roots = []
+        for tree_info in dump["tree_info"]:
+            roots.append(len(nodes["feature"]))
+            stack = [tree_info["tree_structure"]]
+            parents = [None]
+            while stack:
+                node = stack.pop()
+                parent = parents.pop()
+                idx = len(nodes["feature"])
+                if parent is not None:
+                    parent_idx, side = parent
+                    nodes[side][parent_idx] = idx
+                if "split_index" in node:
+                    if node["decision_type"] != "<=":
+                        raise ValueError("Categorical splits are not supported.")
+                    nodes["feature"].append(node["split_feature"])
+                    nodes["threshold"].append(node["threshold"])
+                    nodes["cover"].append(node["internal_count"])
+                    nodes["value"].append(0.0)
+                    nodes["default_left"].append(node["default_left"])
+                    nodes["missing_type"].append(
+                        MISSING_TYPES[node["missing_type"]]
+                    )
+                    nodes["left"].append(-1)
+                    nodes["right"].append(-1)
+                    stack.extend([node["right_child"], node["left_child"]])
+                    parents.extend([(idx, "right"), (idx, "left")])
+                else:
+                    nodes["feature"].append(-1)
+                    nodes["threshold"].append(0.0)
+                    # single leaf trees don't have a leaf count
+                    nodes["cover"].append(node.get("leaf_count", 1))
+                    nodes["value"].append(node["leaf_value"] * scale)
+                    nodes["default_left"].append(False)
+                    nodes["missing_type"].append(0)
+                    nodes["left"].append(-1)
+                    nodes["right"].append(-1)
+        # e.g. 'binary sigmoid:1', where probability = 1 / (1 + exp(-1 * margin))
+        sigmoid = 1.0
+        for param in dump["objective"].split(" "):
+            if param.startswith("sigmoid:"):
+                sigmoid = float(param.split(":")[1])
+        return cls(
+            roots=roots,
+            num_features=dump["max_feature_idx"] + 1,
+            sigmoid=sigmoid,
+            **nodes
+        )
+
+    @classmethod
+    def from_classifier(cls, classifier):
+        return cls.from_booster(classifier.booster_)
+
+    # node arrays, and arrays created by `_compile_paths`
+    NODE_ARRAYS = [
+        "feature",
+        "threshold",
+        "left",
+        "right",
+        "cover",
+        "value",
+        "default_left",
+        "missing_type",
+        "roots"
+    ]
+    PATH_ARRAYS = ["split_node", "edge_split", "edge_left", "slot_start"]
+
+    def to_arrays(self):
+        """
+        Flat dict of all arrays (including compiled paths), and a dict of
+        constants, from which `from_arrays` recreates the ensemble.
+        """
+        arrays = {}
+        for name in self.NODE_ARRAYS + self.PATH_ARRAYS:
+            arrays[name] = getattr(self, name)
+        for idx, group in enumerate(self.groups):
+            for field in PathGroup._fields:
+                if field not in ("depth", "slots"):
+                    arrays["groups/{}/{}".format(idx, field)] = getattr(group, field)
+        for idx, (slots, edges) in enumerate(self.extra_edges):
+            arrays["extra_edges/{}/slots".format(idx)] = slots
+            arrays["extra_edges/{}/edges".format(idx)] = edges
+        constants = {
+            "num_features": self.num_features,
+            "sigmoid": self.sigmoid,
+            "expected_value": self.expected_value,
+            "groups": [
+                [group.depth, group.slots.start, group.slots.stop]
+                for group in self.groups
+            ],
+            "num_extra_edges": len(self.extra_edges)
+        }
+        arrays["slot_delta"] = self.slot_delta
+        return arrays, constants
+
+    @classmethod
+    def from_arrays(cls, arrays, constants):
+        """
+        Ensemble from `to_arrays` output, without compiling paths again (and
+        without copying arrays, which can be memory mapped).
+        """
+        trees = cls.__new__(cls)
+        for name in cls.NODE_ARRAYS + cls.PATH_ARRAYS:
+            setattr(trees, name, arrays[name])
+        trees.num_features = int(constants["num_features"])
+        trees.sigmoid = float(constants["sigmoid"])
+        trees.expected_value = float(constants["expected_value"])
+        trees.groups = []
+        for idx, (depth, start, stop) in enumerate(constants["groups"]):
+            fields = {
+                field: arrays["groups/{}/{}".format(idx, field)]
+                for field in PathGroup._fields if field not in ("depth", "slots")
+            }
+            group = PathGroup(depth=depth, slots=slice(start, stop), **fields)
+            trees.groups.append(group)
+        trees.extra_edges = []
+        for idx in range(constants["num_extra_edges"]):
+            slots = arrays["extra_edges/{}/slots".format(idx)]
+            edges = arrays["extra_edges/{}/edges".format(idx)]
+            trees.extra_edges.append((slots, edges))
+        # not in bundles saved before approximate attributions
+        if "slot_delta" in arrays:
+            trees.slot_delta = arrays["slot_delta"]
+        else:
+            trees.slot_delta = trees._slot_deltas()
+        return trees
+
+    def _compile_paths(self):
+        paths = []  # list of (leaf, [(node, went_left), ...])
+        for root in self.roots:
+            stack = [(root, [])]
+            while stack:
+                node, edges = stack.pop()
+                if self.feature[node] < 0:
+                    paths.append((node, edges))
+                else:
+                    stack.append((self.right[node], edges + [(node, False)]))
+                    stack.append((self.left[node], edges + [(node, True)]))
+
+        # group the edges of each path by split feature (i.e. slot),
+        # and the paths by number of slots, so arrays don't need padding
+        paths_per_depth = {}
+        for leaf, edges in paths:
+            slots = {}
+            for node, went_left in edges:
+                slots.setdefault(self.feature[node], []).append((node, went_left))  # noqa
+            paths_per_depth.setdefault(len(slots), []).append((leaf, edges, slots))  # noqa
+
+        # slots are stored slot-major within a group (i.e. first slot of
+        # all leaves, then second slot of all leaves, ...), so the one
+        # fractions of a group reshape to (depth, leaves, rows) without copies
+        edge_node, edge_left, slot_start = [], [], []
+        self.groups = []
+        for depth in sorted(paths_per_depth):
+            group_paths = paths_per_depth[depth]
+            num_leaves = len(group_paths)
+            leaf_value = np.zeros(num_leaves)
+            leaf_cover_fraction = np.zeros(num_leaves)
+            slot_feature = np.zeros((depth, num_leaves), dtype=np.int32)
+            slot_zero = np.ones((depth, num_leaves))
+            for leaf_idx, (leaf, edges, slots) in enumerate(group_paths):
+                leaf_value[leaf_idx] = self.value[leaf]
+                root_cover = self.cover[edges[0][0]] if edges else self.cover[leaf]  # noqa
+                leaf_cover_fraction[leaf_idx] = self.cover[leaf] / root_cover
+            slot_offset = len(slot_start)
+            for slot_idx in range(depth):
+                for leaf_idx, (leaf, edges, slots) in enumerate(group_paths):
+                    feature, slot_edges = list(slots.items())[slot_idx]
+                    slot_feature[slot_idx, leaf_idx] = feature
+                    slot_start.append(len(edge_node))
+                    for node, went_left in slot_edges:
+                        child = self.left[node] if went_left else self.right[node]  # noqa
+                        slot_zero[slot_idx, leaf_idx] *= (
+                            self.cover[child] / self.cover[node]
+                        )
+                        edge_node.append(node)
+                        edge_left.append(went_left)
+            self.groups.append(PathGroup(
+                depth=depth,
+                leaf_value=leaf_value,
+                leaf_cover_fraction=leaf_cover_fraction,
+                slot_feature=slot_feature,
+                slot_zero=slot_zero,
+                slots=slice(slot_offset, len(slot_start)),
+                weights=shapley_weights(depth),
+                pair_weights=shapley_weights(depth - 1)
+            ))
+        # decisions are only computed for split nodes (i.e. not for leaves)
+        self.split_node = np.nonzero(self.feature >= 0)[0]
+        split_idx = np.zeros(len(self.feature), dtype=np.int64)
+        split_idx[self.split_node] = np.arange(len(self.split_node))
+        self.edge_split = split_idx[np.array(edge_node, dtype=np.int64)]
+        self.edge_left = np.array(edge_left, dtype=bool)
+        self.slot_start = np.array(slot_start, dtype=np.int64)
+        # most slots have a single edge, so other edges are handled apart:
+        # as (slots with more than k edges, index of their k-th edge)
+        num_edges = np.diff(np.append(self.slot_start, len(edge_node)))
+        self.extra_edges = []
+        for k in range(1, max(num_edges, default=1)):
+            slots = np.nonzero(num_edges > k)[0]
+            self.extra_edges.append((slots, self.slot_start[slots] + k))
+        self.expected_value = float(sum(
+            np.dot(group.leaf_value, group.leaf_cover_fraction)
+            for group in self.groups
+        ))
+        self.slot_delta = self._slot_deltas()
+
+    def _node_expectations(self):
+        """
+        Expected leaf value below each node (cover weighted). Children come
+        after their parent in node arrays, so nodes are visited in reverse.
+        """
+        expectation = np.array(self.value, dtype=np.float64)
+        for node in np.nonzero(self.feature >= 0)[0][::-1]:
+            left, right = self.left[node], self.right[node]
+            cover = self.cover[left] + self.cover[right]
+            expectation[node] = (
+                self.cover[left] * expectation[left]
+                + self.cover[right] * expectation[right]
+            ) / cover if cover > 0 else 0.5 * (expectation[left] + expectation[right])
+        return expectation
+
+    def _slot_deltas(self):
+        """
+        Change of expected value along the edges of each slot, i.e. the
+        (Saabas) attribution of the slot's feature when its path is reached.
+        """
+        if len(self.slot_start) == 0:
+            return np.zeros(0)
+        expectation = self._node_expectations()
+        node = self.split_node[self.edge_split]
+        child = np.where(self.edge_left, self.left[node], self.right[node])
+        edge_delta = expectation[child] - expectation[node]
+        slot_delta = edge_delta[self.slot_start]
+        for slots, edges in self.extra_edges:
+            slot_delta[slots] += edge_delta[edges]
+        return slot_delta
+
+    def _decisions(self, X):
+        """
+        Decision of every split node (as rows) for every input row (as
+        columns): True when going left. Follows LightGBM's numerical
+        decision, including the handling of missing values.
+        """
+        nodes = self.split_node
+        values = X.T[self.feature[nodes]]
+        threshold = self.threshold[nodes, None]
+        missing_type = self.missing_type[nodes, None]
+        is_nan = np.isnan(values)
+        if not is_nan.any() and not (missing_type == 1).any():
+            return values <= threshold
+        values = np.where(is_nan & (missing_type != 2), 0.0, values)
+        is_missing = (
+            ((missing_type == 1) & (np.abs(values) <= ZERO_THRESHOLD))
+            | ((missing_type == 2) & is_nan)
+        )
+        go_left = np.where(
+            is_missing, self.default_left[nodes, None], values <= threshold
+        )
+        return go_left
+
+    def _one_fractions(self, X):
+        """
+        One fraction of every slot (of every path), as a float array with a
+        row per slot and a column per input row. A slot is followed if all
+        of its edges are followed.
+        """
+        if len(self.slot_start) == 0:
+            return np.zeros((0, X.shape[0]))
+        go_left = self._decisions(X)
+        edge_follows = go_left[self.edge_split] == self.edge_left[:, None]
+        follows = edge_follows[self.slot_start]
+        for slots, edges in self.extra_edges:
+            follows[slots] &= edge_follows[edges]
+        return follows.astype(np.float64)
+
+    @staticmethod
+    def _group_one_fractions(o, group):
+        # shape (depth, leaves, rows)
+        return o[group.slots].reshape(group.depth, len(group.leaf_value), -1)
+
+    @staticmethod
+    def _polynomial(o, z):
+        """
+        Coefficients of P(t) = prod_s (z_s + o_s * t), with shape
+        (depth + 1, leaves, rows): from the constant to the highest degree.
+        """
+        depth = o.shape[0]
+        p = np.zeros((depth + 1,) + o.shape[1:])
+        p[0] = 1.0
+        for s in range(depth):
+            z_s = z[s, :, None]
+            p[1:s + 2] = p[1:s + 2] * z_s + p[:s + 1] * o[s]
+            p[0] *= z_s
+        return p
+
+    def _chunks(self, X, elements_per_row):
+        X = as_array(X)
+        assert X.ndim == 2, "X should be a 2d array."
+        assert X.shape[1] == self.num_features, "Unexpected number of features."  # noqa
+        size = max(1, CHUNK_ELEMENTS // max(elements_per_row, 1))
+        for start in range(0, X.shape[0], size):
+            yield start, X[start:start + size]
+
+    def predict_margin(self, X):
+        X = as_array(X)
+        margins = np.zeros(X.shape[0])
+        for start, chunk in self._chunks(X, len(self.edge_split)):
+            o = self._one_fractions(chunk)
+            end = start + len(chunk)
+            for group in self.groups:
+                reached = self._group_one_fractions(o, group).all(axis=0)
+                margins[start:end] += group.leaf_value @ reached
+        return margins
+
+    def margin_to_proba(self, margins):
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * np.asarray(margins)))
+
+    def shap_values(self, X):
+        X = as_array(X)
+        phi = np.zeros((X.shape[0], self.num_features))
+        elements_per_row = len(self.slot_start) * 4 + len(self.edge_split)
+        for start, chunk in self._chunks(X, elements_per_row):
+            o = self._one_fractions(chunk)
+            end = start + len(chunk)
+            for group in self.groups:
+                if group.depth == 0:
+                    continue
+                o_group = self._group_one_fractions(o, group)
+                contributions = self._path_shap_values(o_group, group)
+                phi[start:end] += self._scatter(
+                    contributions, group.slot_feature, self.num_features
+                )
+        return phi
+
+    def approximate_shap_values(self, X):
+        """
+        Saabas attributions: like SHAP values, they sum to the margin minus
+        the expected value, but only the features on the reached paths get
+        credit, in the order they're split on. Their error isn't bounded:
+        it was measured at 39% (mean relative L1, at most 72%) on German
+        credit data (see `benchmark.approximation_error`).
+        """
+        X = as_array(X)
+        phi = np.zeros((X.shape[0], self.num_features))
+        for start, chunk in self._chunks(X, len(self.edge_split)):
+            o = self._one_fractions(chunk)
+            end = start + len(chunk)
+            for group in self.groups:
+                if group.depth == 0:
+                    continue
+                reached = self._group_one_fractions(o, group).all(axis=0)
+                delta = self.slot_delta[group.slots].reshape(group.depth, -1)
+                phi[start:end] += self._scatter(
+                    delta[:, :, None] * reached, group.slot_feature, self.num_features
+                )
+        return phi
+
+    def _path_shap_values(self, o, group):
+        z = group.slot_zero[:, :, None]
+        p = self._polynomial(o, group.slot_zero)
+        # remove factor s, when o_s == 1: synthetic division by (z_s + t)
+        q = np.repeat(p[-1:], group.depth, axis=0)
+        one = np.zeros(o.shape)
+        buffer = np.empty(o.shape)
+        for k in range(group.depth - 1, -1, -1):
+            one += np.multiply(q, group.weights[k], out=buffer)
+            np.multiply(q, z, out=q)
+            np.subtract(p[k], q, out=q)
+        # remove factor s, when o_s == 0: division by z_s
+        zero = np.tensordot(group.weights, p[:-1], axes=1) / z
+        return (
+            group.leaf_value[:, None]
+            * (o - z)
+            * np.where(o > 0, one, zero)
+        )
+
+    def shap_interaction_values(self, X, pairs=None):
+        """
+        SHAP interaction values, with shape (rows, features, features).
+
+        When `pairs` (an array of feature index pairs) is given, only paths
+        containing both features of a pair are evaluated and only those
+        pairs are returned: all other values (including the diagonal of main
+        effects, which depends on all pairs) are left at zero.
+        """
+        X = as_array(X)
+        num_features = self.num_features
+        phi = np.zeros((X.shape[0], num_features, num_features))
+        selected = None
+        if pairs is not None:
+            pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+            selected = np.zeros((num_features, num_features), dtype=bool)
+            selected[pairs[:, 0], pairs[:, 1]] = True
+            selected[pairs[:, 1], pairs[:, 0]] = True
+            np.fill_diagonal(selected, False)
+        max_depth = max([group.depth for group in self.groups] + [0])
+        elements_per_row = len(self.slot_start) * (max_depth + 1) * 2
+        for start, chunk in self._chunks(X, elements_per_row):
+            o = self._one_fractions(chunk)
+            end = start + len(chunk)
+            for group in self.groups:
+                if group.depth < 2:
+                    continue
+                o_group = self._group_one_fractions(o, group)
+                pair_feature = (
+                    group.slot_feature[:, None, :] * num_features
+                    + group.slot_feature[None, :, :]
+                )
+                if selected is not None:
+                    pair_selected = selected.reshape(-1)[pair_feature]
+                    leaves = pair_selected.any(axis=(0, 1))
+                    if not leaves.any():
+                        continue
+                    group = group._replace(
+                        leaf_value=group.leaf_value[leaves],
+                        slot_feature=group.slot_feature[:, leaves],
+                        slot_zero=group.slot_zero[:, leaves]
+                    )
+                    o_group = o_group[:, leaves]
+                    pair_feature = pair_feature[:, :, leaves]
+                contributions = self._path_interaction_values(o_group, group)
+                if selected is not None:
+                    contributions *= pair_selected[:, :, leaves, None]
+                phi[start:end] += self._scatter(
+                    contributions, pair_feature, num_features ** 2
+                ).reshape(-1, num_features, num_features)
+        if selected is not None:
+            return phi
+        # main effects are what remains of the SHAP values
+        diagonal = self.shap_values(X) - phi.sum(axis=2)
+        idxs = np.arange(num_features)
+        phi[:, idxs, idxs] = diagonal
+        return phi
+
+    def _path_interaction_values(self, o, group):
+        depth = group.depth
+        z = group.slot_zero[:, :, None]
+        p = self._polynomial(o, group.slot_zero)
+        # remove factor i: coefficients of Q_i(t), with shape
+        # (slot i, coefficient, leaves, rows)
+        q_one = np.zeros((depth, depth) + o.shape[1:])
+        q = np.broadcast_to(p[-1], o.shape)
+        for k in range(depth - 1, -1, -1):
+            q_one[:, k] = q
+            q = p[k] - z * q
+        q_zero = p[None, :-1] / z[:, None]
+        q = np.where(o[:, None] > 0, q_one, q_zero)
+        # remove factor j from Q_i(t), and sum with Shapley weights
+        weights = group.pair_weights
+        r = np.broadcast_to(q[:, None, -1], (depth,) + o.shape)
+        one = np.zeros((depth,) + o.shape)
+        for k in range(depth - 2, -1, -1):
+            one += weights[k] * r
+            r = q[:, None, k] - z[None] * r
+        zero = np.tensordot(q[:, :-1], weights, axes=([1], [0]))[:, None] / z[None]  # noqa
+        # an interaction is shared equally between i and j
+        not_self = ~np.eye(depth, dtype=bool)[:, :, None, None]
+        return (
+            group.leaf_value[:, None]
+            * (o - z)[:, None]
+            * (o - z)[None, :]
+            * np.where(o[None, :] > 0, one, zero)
+            * not_self
+            / 2
+        )
+
+    @staticmethod
+    def _scatter(contributions, idxs, size):
+        """
+        Sums contributions (with rows as last axis) into `size` bins per row,
+        where idxs gives the bin of each contribution (without rows axis).
+        """
+        num_rows = contributions.shape[-1]
+        bins = idxs[..., None] + np.arange(num_rows) * size
+        totals = np.bincount(
+            bins.reshape(-1),
+            weights=contributions.reshape(-1),
+            minlength=num_rows * size
+        )
+        return totals.reshape(num_rows, size)
@@ -1,3 +1,6 @@
+import io
+import json
+import numpy as np
 from sagemaker.predictor import (
     RealTimePredictor,
     json_serializer,
@@ -6,6 +9,49 @@ from sagemaker.predictor import (
 )
 
 
+CONTENT_TYPE_NPZ = "application/x-npz"
+# nested keys are flattened with this separator in binary responses
+KEY_SEPARATOR = "/"
+
+
+def npz_deserializer(stream, content_type):
+    """
+    Decodes a binary (NumPy archive) response into the same nested structure
+    as a JSON response, but with arrays (that have records as first axis
+    for batch requests). Feature names are given once as 'feature_names',
+    and the error of each failed record (if any) under 'error'.
+    """
+    try:
+        body = stream.read()
+    finally:
+        stream.close()
+    output = {}
+    with np.load(io.BytesIO(body), allow_pickle=False) as arrays:
+        for key in arrays.files:
+            value = arrays[key]
+            if key == "data":
+                if value.ndim == 0:
+                    value = json.loads(value.item())
+                else:
+                    value = [json.loads(record) for record in value]
+            elif key == "error":
+                # error objects of failed records (None for other records)
+                if value.ndim == 0:
+                    value = json.loads(value.item()) if value.item() else None
+                else:
+                    value = [json.loads(error) if error else None for error in value]
+            elif key == "descriptions":
+                value = dict(zip(arrays["feature_names"].tolist(), value.tolist()))
+            elif value.ndim == 0:
+                value = value.item()
+            parent = output
+            *parents, name = key.split(KEY_SEPARATOR)
+            for parent_key in parents:
+                parent = parent.setdefault(parent_key, {})
+            parent[name] = value
+    return output
+
+
 class Predictor(RealTimePredictor):
     def __init__(self, endpoint_name, sagemaker_session=None):
         super(Predictor, self).__init__(
@@ -19,7 +65,7 @@ class Predictor(RealTimePredictor):
 
 
 class Explainer(RealTimePredictor):
-    def __init__(self, endpoint_name, sagemaker_session=None):
+    def __init__(self, endpoint_name, sagemaker_session=None, binary=False):
         entities = [
             'data',
             'features',
@@ -32,7 +78,7 @@ class Explainer(RealTimePredictor):
             endpoint=endpoint_name,
             sagemaker_session=sagemaker_session,
             serializer=json_serializer,
-            deserializer=json_deserializer,
+            deserializer=npz_deserializer if binary else json_deserializer,
             content_type="application/json; entities={}".format(",".join(entities)),
-            accept=CONTENT_TYPE_JSON,
+            accept=CONTENT_TYPE_NPZ if binary else CONTENT_TYPE_JSON,
         )
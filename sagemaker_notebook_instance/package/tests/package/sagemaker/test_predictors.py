@@ -0,0 +1,58 @@
+import io
+import numpy as np
+
+import explaining
+from package.sagemaker import predictors
+
+
+ENTITIES = [
+    'data',
+    'descriptions',
+    'prediction',
+    'explanation_shap_values',
+    'explanation_shap_values_topk'
+]
+
+
+def round_trip(request, model_assets):
+    prediction = explaining.predict_fn(dict(request, entities=ENTITIES), model_assets)
+    stream = io.BytesIO(prediction.to_npz())
+    output = predictors.npz_deserializer(stream, predictors.CONTENT_TYPE_NPZ)
+    assert stream.closed
+    return prediction.records(), output
+
+
+def test_npz_deserializer_single(records, model_assets):
+    (expected,), output = round_trip({'data': records[0]}, model_assets)
+    feature_names = output['feature_names'].tolist()
+    assert output['data'] == expected['data'] == records[0]
+    assert output['descriptions'] == expected['descriptions']
+    np.testing.assert_allclose(output['prediction'], expected['prediction'], rtol=1e-6)
+    shap_values = [expected['explanation']['shap_values'][name] for name in feature_names]
+    np.testing.assert_allclose(output['explanation']['shap_values'], shap_values, rtol=1e-5)
+    topk = output['explanation']['shap_values_topk']
+    assert [feature_names[idx] for idx in topk['idxs']] == expected['explanation']['shap_values_topk']['features']  # noqa
+    assert 'error' not in output
+
+
+def test_npz_deserializer_batch(records, model_assets):
+    expected, output = round_trip({'data': records[:4], 'batch': True}, model_assets)
+    assert output['data'] == records[:4]
+    assert output['prediction'].shape == (4,)
+    np.testing.assert_allclose(
+        output['prediction'], [record['prediction'] for record in expected], rtol=1e-6
+    )
+    assert output['explanation']['shap_values'].shape == (4, len(output['feature_names']))
+    assert isinstance(output['explanation']['expected_value'], float)  # shared
+    assert output['descriptions'] == expected[0]['descriptions']
+
+
+def test_npz_deserializer_errors(records, model_assets):
+    invalid = dict(records[1], credit__amount='a lot')
+    data = [records[0], invalid, records[2]]
+    expected, output = round_trip({'data': data, 'batch': True}, model_assets)
+    assert output['data'] == data
+    assert output['error'][0] is None and output['error'][2] is None
+    assert output['error'][1] == expected[1]['error']
+    assert output['error'][1]['type'] == 'ValidationError'
+    assert np.isfinite(output['prediction'][[0, 2]]).all()
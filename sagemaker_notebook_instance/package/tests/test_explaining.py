@@ -0,0 +1,415 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import json
+import numpy as np
+import pytest
+
+import explaining
+
+
+ENTITIES = [
+    'data',
+    'features',
+    'descriptions',
+    'prediction',
+    'explanation_shap_values',
+    'explanation_shap_interaction_values'
+]
+CONTENT_TYPE = "application/json; entities={}".format(",".join(ENTITIES))
+JSONLINES_CONTENT_TYPE = "application/jsonlines; entities={}".format(",".join(ENTITIES))  # noqa
+
+
+def predict(request, model_assets):
+    records = explaining.predict_fn(request, model_assets).records()
+    return records if request.get('batch', False) else records[0]
+
+
+def test_input_fn_single(records):
+    request = explaining.input_fn(json.dumps(records[0]), CONTENT_TYPE)
+    assert request['data'] == records[0]
+    assert request['entities'] == ENTITIES
+    assert not request['batch']
+
+
+def test_input_fn_json_array(records):
+    request = explaining.input_fn(json.dumps(records[:3]), CONTENT_TYPE)
+    assert request['data'] == records[:3]
+    assert request['batch']
+
+
+def test_input_fn_json_lines(records):
+    body = "\n".join(json.dumps(record) for record in records[:3]) + "\n"
+    request = explaining.input_fn(body, JSONLINES_CONTENT_TYPE)
+    assert request['data'] == records[:3]
+    assert request['batch']
+
+
+def test_predict_fn_json_lines_invalid_lines(records, model_assets):
+    lines = [
+        json.dumps(records[0]),
+        json.dumps(records[1]) + "," + json.dumps(records[2]),
+        "{not json",
+        json.dumps(records[3])
+    ]
+    request = explaining.input_fn("\n".join(lines), JSONLINES_CONTENT_TYPE)
+    assert len(request['data']) == 4
+    prediction = explaining.predict_fn(request, model_assets)
+    output = explaining.output_fn(prediction, "application/jsonlines").split("\n")
+    assert len(output) == 4
+    responses = [json.loads(line) for line in output]
+    assert 'error' not in responses[0] and 'error' not in responses[3]
+    for idx in [1, 2]:
+        assert responses[idx]['error']['type'] == 'JSONDecodeError'
+        assert responses[idx]['data'] == lines[idx]
+    assert 'char 1' in responses[2]['error']['message']
+
+
+def test_predict_fn_csv(records, model_assets):
+    titles = model_assets["data_schema"].item_titles
+    rows = [[record[title] for title in titles] for record in records[:5]]
+    body = "\n".join(
+        ",".join(str(value).lower() if isinstance(value, bool) else str(value) for value in row)  # noqa
+        for row in rows
+    ) + "\n"
+    content_type = "text/csv; entities={}".format(",".join(ENTITIES))
+    request = explaining.input_fn(body, content_type)
+    assert request['batch']
+    assert len(request['data']) == len(rows)
+    prediction = explaining.predict_fn(request, model_assets)
+    lines = explaining.output_fn(prediction, "application/jsonlines").split("\n")
+    expected = predict({'data': records[:5], 'entities': ENTITIES, 'batch': True}, model_assets)  # noqa
+    assert len(lines) == len(expected)
+    for line, response in zip(lines, expected):
+        line = json.loads(line)
+        assert line['data'] == [response['data'][title] for title in titles]
+        assert line['prediction'] == response['prediction']
+        assert line['explanation'] == response['explanation']
+
+
+def test_predict_fn_batch_matches_single(records, model_assets):
+    batch_request = {'data': records, 'entities': ENTITIES, 'batch': True}
+    batch_responses = predict(batch_request, model_assets)
+    assert len(batch_responses) == len(records)
+    for record, batch_response in zip(records, batch_responses):
+        request = {'data': record, 'entities': ENTITIES, 'batch': False}
+        response = predict(request, model_assets)
+        assert batch_response['data'] == record
+        assert batch_response['features'] == response['features']
+        assert np.isclose(batch_response['prediction'], response['prediction'])
+        explanation = response['explanation']
+        batch_explanation = batch_response['explanation']
+        assert np.isclose(batch_explanation['expected_value'], explanation['expected_value'])  # noqa
+        np.testing.assert_allclose(
+            list(batch_explanation['shap_values'].values()),
+            list(explanation['shap_values'].values()),
+            atol=1e-6
+        )
+        np.testing.assert_allclose(
+            batch_explanation['shap_interaction_values']['values'],
+            explanation['shap_interaction_values']['values'],
+            atol=1e-6
+        )
+
+
+def test_output_fn_json_lines(records, model_assets):
+    request = {'data': records[:3], 'entities': ['prediction'], 'batch': True}
+    predictions = explaining.predict_fn(request, model_assets)
+    body = explaining.output_fn(predictions, "application/jsonlines")
+    lines = body.split("\n")
+    assert len(lines) == 3
+    assert [json.loads(line) for line in lines] == predictions.records()
+
+
+def test_predict_fn_concurrent(records, model_assets):
+    entities = ['explanation_shap_values', 'explanation_shap_interaction_values']
+    requests = [
+        {'data': record, 'entities': entities, 'batch': False}
+        for record in records
+    ]
+    expected = [predict(r, model_assets) for r in requests]
+    expected_value = model_assets["explainer"].expected_value
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(
+            lambda r: predict(r, model_assets), requests * 4
+        ))
+    assert model_assets["explainer"].expected_value == expected_value
+    for idx, response in enumerate(responses):
+        assert response == expected[idx % len(expected)]
+
+
+def test_predict_fn_prediction_from_shap_values(records, model_assets):
+    request = {'data': records, 'entities': ['prediction'], 'batch': True}
+    predictions = [r['prediction'] for r in predict(request, model_assets)]  # noqa
+    for entity in ['explanation_shap_values', 'explanation_shap_interaction_values']:  # noqa
+        request['entities'] = ['prediction', entity]
+        responses = predict(request, model_assets)
+        fused_predictions = [r['prediction'] for r in responses]
+        np.testing.assert_allclose(fused_predictions, predictions, atol=1e-9)
+
+
+def test_input_fn_parameters(records):
+    content_type = (
+        "application/json; "
+        "entities=prediction,explanation_shap_interactions_topk=5; "
+        "interaction_pairs=a:b|c:d"
+    )
+    request = explaining.input_fn(json.dumps(records[0]), content_type)
+    assert request['entities'] == ['prediction', 'explanation_shap_interactions_topk']  # noqa
+    assert request['parameters'] == {
+        'explanation_shap_interactions_topk': '5',
+        'interaction_pairs': 'a:b|c:d'
+    }
+
+
+def test_predict_fn_interactions_topk(records, model_assets):
+    k = 5
+    request = {
+        'data': records[:8],
+        'entities': [
+            'explanation_shap_interaction_values',
+            'explanation_shap_interactions_topk'
+        ],
+        'parameters': {'explanation_shap_interactions_topk': str(k)},
+        'batch': True
+    }
+    responses = predict(request, model_assets)
+    for response in responses:
+        dense = np.array(response['explanation']['shap_interaction_values']['values'])  # noqa
+        topk = response['explanation']['shap_interactions_topk']
+        assert len(topk['values']) == k
+        assert all(r < c for r, c in zip(topk['rows'], topk['columns']))
+        np.testing.assert_allclose(dense[topk['rows'], topk['columns']], topk['values'])  # noqa
+        np.testing.assert_allclose(np.diagonal(dense), topk['diagonal'])
+        upper = np.abs(dense[np.triu_indices(len(dense), k=1)])
+        np.testing.assert_allclose(np.abs(topk['values']), np.sort(upper)[::-1][:k])  # noqa
+
+
+def test_predict_fn_topk_negative(records, model_assets):
+    entities = [
+        'explanation_shap_interactions_topk',
+        'explanation_shap_values_topk',
+        'explanation_reason_codes'
+    ]
+    for entity in entities:
+        request = {'data': records[0], 'entities': [entity], 'parameters': {entity: '-1'}}
+        with pytest.raises(AssertionError, match='non-negative'):
+            explaining.predict_fn(request, model_assets)
+
+
+def test_predict_fn_interactions_topk_pairs(records, model_assets):
+    feature_names = model_assets["features_schema"].item_titles
+    pairs = [(feature_names[0], feature_names[1]), (feature_names[2], feature_names[0])]  # noqa
+    request = {
+        'data': records[:8],
+        'entities': [
+            'explanation_shap_interaction_values',
+            'explanation_shap_interactions_topk'
+        ],
+        'parameters': {},
+        'batch': True
+    }
+    dense_responses = predict(request, model_assets)
+    request['entities'] = ['explanation_shap_interactions_topk']
+    request['parameters'] = {
+        'interaction_pairs': '|'.join('{}:{}'.format(*p) for p in pairs)
+    }
+    responses = predict(request, model_assets)
+    for response, dense_response in zip(responses, dense_responses):
+        dense = np.array(dense_response['explanation']['shap_interaction_values']['values'])  # noqa
+        topk = response['explanation']['shap_interactions_topk']
+        assert 'diagonal' not in topk
+        assert sorted(zip(topk['rows'], topk['columns'])) == [(0, 1), (0, 2)]
+        np.testing.assert_allclose(dense[topk['rows'], topk['columns']], topk['values'])  # noqa
+
+
+def test_output_fn_npz(records, model_assets):
+    entities = ENTITIES + ['explanation_shap_interactions_topk']
+    request = {'data': records[:3], 'entities': entities, 'batch': True}
+    predictions = explaining.predict_fn(request, model_assets)
+    body = explaining.output_fn(predictions, "application/x-npz")
+    arrays = np.load(io.BytesIO(body), allow_pickle=False)
+    responses = predictions.records()
+    feature_names = model_assets["features_schema"].item_titles
+    assert arrays['feature_names'].tolist() == feature_names
+    assert arrays['explanation/shap_values'].dtype == np.float32
+    assert arrays['explanation/shap_interaction_values'].shape == (3, len(feature_names), len(feature_names))  # noqa
+    for idx, response in enumerate(responses):
+        assert json.loads(arrays['data'][idx]) == response['data']
+        assert np.isclose(arrays['prediction'][idx], response['prediction'])
+        np.testing.assert_allclose(
+            arrays['explanation/shap_values'][idx],
+            [response['explanation']['shap_values'][k] for k in feature_names],
+            rtol=1e-5, atol=1e-6
+        )
+        assert arrays['explanation/shap_interactions_topk/rows'][idx].tolist() == response['explanation']['shap_interactions_topk']['rows']  # noqa
+
+
+def test_plan_fn():
+    assert list(explaining.plan_fn(['descriptions'], {})) == ['descriptions']
+    plan = explaining.plan_fn(['prediction'], {})
+    assert list(plan) == ['records', 'array', 'features', 'prediction']
+    plan = explaining.plan_fn(['prediction', 'explanation_shap_interaction_values'], {})  # noqa
+    assert plan.steps['prediction'].requires == ['margin']
+    assert plan.steps['shap_values'].requires == ['interaction_values']
+    assert list(plan).count('features') == 1
+    plan = explaining.plan_fn(
+        ['explanation_shap_interactions_topk'], {'interaction_pairs': 'a:b'}
+    )
+    assert 'interaction_values' not in plan
+    assert 'pair_interaction_values' in plan
+
+
+def test_predict_fn_descriptions_only(records, model_assets):
+    # nothing needs the features, so records aren't validated or transformed
+    request = {'data': {'invalid': None}, 'entities': ['descriptions'], 'batch': False}  # noqa
+    response = predict(request, model_assets)
+    assert response == {
+        'descriptions': model_assets["features_schema"].item_descriptions_dict
+    }
+
+
+def test_predict_fn_shap_values_topk(records, model_assets):
+    k = 3
+    request = {
+        'data': records[:8],
+        'entities': ['explanation_shap_values', 'explanation_shap_values_topk'],
+        'parameters': {'explanation_shap_values_topk': str(k)},
+        'batch': True
+    }
+    responses = predict(request, model_assets)
+    for response in responses:
+        shap_values = response['explanation']['shap_values']
+        topk = response['explanation']['shap_values_topk']
+        assert len(topk['features']) == k
+        expected = sorted(shap_values, key=lambda name: -abs(shap_values[name]))[:k]  # noqa
+        assert topk['features'] == expected
+        assert topk['values'] == [shap_values[name] for name in expected]
+        assert np.isclose(
+            topk['other_features'] + sum(topk['values']), sum(shap_values.values())  # noqa
+        )
+
+
+def test_predict_fn_shap_values_grouped(records, model_assets):
+    request = {
+        'data': records[:8],
+        'entities': ['explanation_shap_values', 'explanation_shap_values_grouped'],
+        'batch': True
+    }
+    responses = predict(request, model_assets)
+    data_fields = model_assets["data_schema"].item_titles
+    for response in responses:
+        shap_values = response['explanation']['shap_values']
+        grouped = response['explanation']['shap_values_grouped']
+        assert set(data_fields) <= set(grouped)
+        for field, value in grouped.items():
+            expected = sum(
+                v for name, v in shap_values.items()
+                if name == field or name.startswith(field + '__')
+            )
+            assert np.isclose(value, expected)
+        assert np.isclose(sum(grouped.values()), sum(shap_values.values()))
+
+
+def test_predict_fn_invalid_records(records, model_assets):
+    entities = ['data', 'prediction', 'explanation_shap_values_topk']
+    invalid = dict(records[1], credit__amount='invalid')
+    data = [records[0], invalid, records[2], {'unknown': 1}]
+    responses = predict({'data': data, 'entities': entities, 'batch': True}, model_assets)
+    assert len(responses) == len(data)
+    for idx in [1, 3]:
+        assert responses[idx]['error']['type'] == 'ValidationError'
+        assert responses[idx]['data'] == data[idx]
+    expected = predict({'data': [records[0], records[2]], 'entities': entities, 'batch': True}, model_assets)  # noqa
+    assert [responses[0], responses[2]] == expected
+    # npz responses flag failed records, and all invalid records still respond
+    prediction = explaining.predict_fn({'data': data, 'entities': entities, 'batch': True}, model_assets)  # noqa
+    arrays = np.load(io.BytesIO(prediction.to_npz()), allow_pickle=False)
+    assert [bool(error) for error in arrays['error']] == [False, True, False, True]
+    assert np.isnan(arrays['prediction'][1])
+    responses = predict({'data': [invalid], 'entities': entities, 'batch': True}, model_assets)  # noqa
+    assert list(responses[0]) == ['error', 'data']
+
+
+def test_parse_rows_isolates_rows(records, model_assets):
+    data_schema = model_assets["data_schema"]
+    rows = [
+        ['true', '1000', '12', 'car', 'low', '30', 'rent'],
+        ['true', '1000.0', '12', 'car', 'low', '30', 'rent'],
+        ['true', '1000']
+    ]
+    data = explaining.parse_rows(rows, data_schema)
+    assert data[0] == [True, 1000, 12, 'car', 'low', 30, 'rent']
+    assert [explaining.record_data(record) for record in data[1:]] == rows[1:]
+    errors = explaining.validate_records(data, model_assets)
+    assert [error is None for error in errors] == [True, False, False]
+    assert str(errors[1]) == "'credit__amount' should be of type integer."
+    assert str(errors[2]) == "Rows should have 7 values, not 2."
+
+
+def test_parse_rows_integer_overflow(records, model_assets):
+    rows = [
+        ['true', '1000', '12', 'car', 'low', '30', 'rent'],
+        ['true', '99999999999999999999999', '12', 'car', 'low', '30', 'rent']
+    ]
+    data = explaining.parse_rows(rows, model_assets["data_schema"])
+    assert data[0] == [True, 1000, 12, 'car', 'low', 30, 'rent']
+    assert isinstance(data[1], explaining.InvalidRecord)
+    errors = explaining.validate_records(data, model_assets)
+    assert errors[0] is None
+    assert str(errors[1]) == "'credit__amount' should be of type integer."
+
+
+def test_predict_fn_typed_columns(records, model_assets, monkeypatch):
+    request = {'data': records, 'entities': ENTITIES, 'batch': True}
+    expected = predict(request, model_assets)
+    monkeypatch.setattr(explaining, "COLUMNS_MIN_RECORDS", 2)
+    assert predict(request, model_assets) == expected
+
+
+def test_predict_fn_approximate(records, model_assets):
+    entities = ['prediction', 'explanation_shap_values']
+    request = {'data': records[:8], 'entities': entities, 'batch': True}
+    exact = predict(request, model_assets)
+    request['parameters'] = {'approximate': 'true'}
+    approximate = predict(request, model_assets)
+    for exact_response, response in zip(exact, approximate):
+        shap_values = response['explanation']['shap_values']
+        assert list(shap_values) == list(exact_response['explanation']['shap_values'])
+        assert np.isclose(
+            sum(shap_values.values()),
+            sum(exact_response['explanation']['shap_values'].values())
+        )
+        assert np.isclose(response['prediction'], exact_response['prediction'])
+    for entity, parameters in [
+        ('explanation_shap_interaction_values', {}),
+        ('explanation_shap_interactions_topk', {}),
+        ('explanation_shap_interactions_topk', {'interaction_pairs': 'a:b'})
+    ]:
+        parameters = dict(parameters, approximate='true')
+        with pytest.raises(AssertionError, match="approximate=true"):
+            explaining.plan_fn(['explanation_shap_values', entity], parameters)
+
+
+def test_predict_fn_reason_codes(records, model_assets):
+    request = {
+        'data': records[:8],
+        'entities': ['explanation_shap_values_grouped', 'explanation_reason_codes'],
+        'parameters': {'explanation_reason_codes': '3'},
+        'batch': True
+    }
+    responses = predict(request, model_assets)
+    for response in responses:
+        grouped = response['explanation']['shap_values_grouped']
+        reason_codes = response['explanation']['reason_codes']
+        expected = sorted(
+            (field for field, value in grouped.items() if value > 0),
+            key=lambda field: -grouped[field]
+        )[:3]
+        assert [reason['field'] for reason in reason_codes] == expected
+        for reason in reason_codes:
+            assert reason['value'] == grouped[reason['field']]
+            assert reason['code'].startswith('R')
+    prediction = explaining.predict_fn(dict(request, data=records[0], batch=False), model_assets)  # noqa
+    arrays = np.load(io.BytesIO(prediction.to_npz()), allow_pickle=False)
+    assert arrays['explanation/reason_codes/idxs'].shape == (3,)
+    assert len(arrays['explanation/reason_table/codes']) == len(arrays['explanation/fields'])  # noqa
@@ -0,0 +1,124 @@
+import json
+from pathlib import Path
+import threading
+import pytest
+
+import bundles
+import explaining
+import models
+import timing
+
+
+def create_models_dir(tmp_path, sizes):
+    for model_id, size in sizes.items():
+        Path(tmp_path, model_id).mkdir()
+        Path(tmp_path, model_id, bundles.FILENAME).write_bytes(b"0" * size)
+    return tmp_path
+
+
+def test_model_bytes(tmp_path):
+    for filename, size in [("classifier.joblib", 10), ("preprocessor.joblib", 5), ("data.schema.json", 100)]:  # noqa
+        Path(tmp_path, filename).write_bytes(b"0" * size)
+    assert models.model_bytes(tmp_path) == 15
+    Path(tmp_path, bundles.FILENAME).write_bytes(b"0" * 20)
+    assert models.model_bytes(tmp_path) == 20
+
+
+def test_model_registry_lru(tmp_path):
+    models_dir = create_models_dir(tmp_path, {'a': 40, 'b': 40, 'c': 40})
+    unloaded = []
+    registry = models.ModelRegistry(
+        models_dir, lambda model_dir: {'id': model_dir.name}, unloaded.append, max_bytes=100
+    )
+    assert registry.get('a') == {'id': 'a'}
+    assert registry.get('b') == {'id': 'b'}
+    assert registry.get('a') is registry.get('a')  # 'b' is now least recently used
+    registry.get('c')
+    assert unloaded == [{'id': 'b'}]
+    assert 'b' not in registry and 'a' in registry and 'c' in registry
+    assert registry.counters() == {
+        'hits': 2, 'loads': 3, 'load_errors': 0, 'load_seconds': 0.,
+        'evictions': 1, 'models': ['a', 'c'], 'bytes': 80
+    }
+
+
+def test_model_registry_cold_load_doesnt_block(tmp_path):
+    models_dir = create_models_dir(tmp_path, {'warm': 1, 'cold': 1})
+    release = threading.Event()
+
+    def load_fn(model_dir):
+        if model_dir.name == 'cold':
+            release.wait(10)
+        return {'id': model_dir.name}
+
+    registry = models.ModelRegistry(models_dir, load_fn)
+    registry.get('warm')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get('cold'))) for _ in range(2)]  # noqa
+    for thread in threads:
+        thread.start()
+    assert registry.get('warm') == {'id': 'warm'}
+    assert not results
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [{'id': 'cold'}] * 2
+    assert registry.counters()['loads'] == 2
+
+
+def test_model_registry_invalid_models(tmp_path):
+    registry = models.ModelRegistry(create_models_dir(tmp_path, {'a': 1}), dict)
+    for model_id in ['../a', '', 'unknown']:
+        with pytest.raises(AssertionError):
+            registry.get(model_id)
+    assert registry.counters()['load_errors'] == 3
+
+
+def test_predict_fn_multi_model(records, model_dir, tmp_path, monkeypatch):
+    for model_id in ['a', 'b']:
+        Path(tmp_path, model_id).symlink_to(Path(model_dir).resolve())
+    monkeypatch.setenv('MULTI_MODEL', 'true')
+    monkeypatch.setattr(timing, 'COUNTERS', {})
+    model_assets = explaining.model_fn(tmp_path)
+    request = explaining.input_fn(
+        json.dumps(records[0]), "application/json; entities=prediction; model=a"
+    )
+    assert request['parameters']['model'] == 'a'
+    prediction = explaining.predict_fn(request, model_assets).records()[0]
+    assert 0 <= prediction['prediction'] <= 1
+    assert model_assets['models'].counters()['models'] == ['a']
+    with pytest.raises(AssertionError):
+        explaining.predict_fn(dict(request, parameters={}), model_assets)
+
+
+def test_multi_model_cache_counters(records, model_dir, tmp_path, monkeypatch):
+    for model_id in ['a', 'b']:
+        Path(tmp_path, model_id).symlink_to(Path(model_dir).resolve())
+    monkeypatch.setenv('MULTI_MODEL', 'true')
+    monkeypatch.setenv('MODELS_MAX_BYTES', '1')  # a single model at a time
+    monkeypatch.setenv('CACHE_ENTRIES', '100')
+    monkeypatch.setattr(timing, 'COUNTERS', {})
+    model_assets = explaining.model_fn(tmp_path)
+    for model_id in ['a', 'a', 'b']:
+        request = {
+            'data': records[0],
+            'entities': ['prediction'],
+            'parameters': {'model': model_id}
+        }
+        explaining.predict_fn(request, model_assets)
+    counters = timing.dump()['counters']
+    assert 'cache/a' not in counters  # unloaded
+    assert counters['cache/b']['misses'] == 1
+    assert counters['models']['evictions'] == 1
+
+
+def test_unload_model_keeps_reloaded_counters(model_dir, tmp_path, monkeypatch):
+    Path(tmp_path, 'a').symlink_to(Path(model_dir).resolve())
+    monkeypatch.setenv('CACHE_ENTRIES', '100')
+    monkeypatch.setattr(timing, 'COUNTERS', {})
+    evicted = explaining.load_hosted_model(Path(tmp_path, 'a'))
+    reloaded = explaining.load_hosted_model(Path(tmp_path, 'a'))
+    explaining.unload_model(evicted)
+    assert timing.COUNTERS['cache/a'] == reloaded['cache'].counters
+    explaining.unload_model(reloaded)
+    assert 'cache/a' not in timing.COUNTERS
@@ -0,0 +1,34 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+from package import utils
+
+current_folder = utils.get_current_folder(globals())
+src_path = Path(current_folder, "../../containers/model/src").resolve()
+package_path = Path(current_folder, "..").resolve()
+
+
+def run(code, **environ):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(src_path), str(package_path)]), **environ)  # noqa
+    return subprocess.run(
+        [sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True
+    ).stdout
+
+
+def test_serving_imports():
+    code = (
+        "import sys, entry_point, explaining; "
+        "print(sorted(m for m in ['sklearn', 'lightgbm', 'training'] if m in sys.modules))"  # noqa
+    )
+    assert run(code).strip() == "[]"
+
+
+def test_startup_profile(model_dir):
+    code = "import entry_point; entry_point.model_fn({!r})".format(str(model_dir))
+    stdout = run(code, STARTUP_PROFILE="true")
+    line = [l for l in stdout.splitlines() if l.startswith("startup: ")][0]  # noqa
+    stages = json.loads(line[len("startup: "):])['stages']
+    assert list(stages) == ['import_explaining', 'load_bundle', 'group_fields']
@@ -0,0 +1,52 @@
+import json
+
+import explaining
+import timing
+
+
+def test_timings():
+    timings = timing.Timings()
+    assert timings.time('stage', sum, [1, 2]) == 3
+    timings.time('stage', sum, [3])
+    timings.size('records', 2)
+    assert list(timings.stages) == ['stage']
+    assert timings.stages['stage'] > 0
+    assert timings.header().startswith('stage;dur=')
+    assert timing.timed(None, 'stage', sum, [1, 2]) == 3
+
+
+def test_histograms():
+    histograms = timing.Histograms(samples=100)
+    for milliseconds in range(200):
+        histograms.add({'stage': float(milliseconds)})
+    summary = histograms.percentiles()
+    assert summary['stage']['count'] == 100
+    assert summary['stage']['p50'] == 149.5
+    assert summary['stage']['p99'] > summary['stage']['p95'] > summary['stage']['p50']  # noqa
+
+
+def test_request_timings(records, model_assets, monkeypatch, capsys):
+    monkeypatch.setattr(timing, 'ENABLED', True)
+    histograms = timing.Histograms()
+    monkeypatch.setattr(timing, 'HISTOGRAMS', histograms)
+    body = json.dumps(records[:4])
+    content_type = "application/json; entities=prediction,explanation_shap_values"
+    request = explaining.input_fn(body, content_type)
+    predictions = explaining.predict_fn(request, model_assets)
+    explaining.output_fn(predictions, "application/json")
+    stages = predictions.timings.stages
+    for stage in ['input_fn', 'records', 'features', 'shap_values', 'prediction', 'output_fn']:  # noqa
+        assert stage in stages
+    assert predictions.timings.sizes['records'] == 4
+    assert predictions.timings.sizes['request_bytes'] == len(body)
+    line = capsys.readouterr().out.strip().split('timings: ', 1)[1]
+    assert json.loads(line)['sizes']['records'] == 4
+    assert set(timing.dump()["stages"]) == set(stages)
+
+
+def test_request_timings_disabled(records, model_assets, monkeypatch):
+    monkeypatch.setattr(timing, 'ENABLED', False)
+    request = explaining.input_fn(json.dumps(records[0]), "application/json")
+    assert request['timings'] is None
+    predictions = explaining.predict_fn(request, model_assets)
+    assert predictions.timings is None
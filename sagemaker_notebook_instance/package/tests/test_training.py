@@ -0,0 +1,34 @@
+from pathlib import Path
+from sklearn.pipeline import Pipeline
+
+import training
+
+
+def test_train_fn_cross_validates_pipeline(model_dir, tmp_path, monkeypatch, capsys):
+    import entry_point as ep
+
+    # data of the model_dir fixture (see `conftest.py`)
+    data_folder = Path(model_dir).parent
+    sys_args = [
+        "--cv-splits", "3",
+        "--model-dir", str(Path(tmp_path, "model")),
+        "--schemas", str(Path(data_folder, "schemas")),
+        "--data-train", str(Path(data_folder, "data_train")),
+        "--label-train", str(Path(data_folder, "label_train")),
+        "--data-test", str(Path(data_folder, "data_test")),
+        "--label-test", str(Path(data_folder, "label_test"))
+    ]
+    cross_validated = []
+    log_cross_val_auc = training.log_cross_val_auc
+
+    def log(clf, X, y, cv_splits, log_prefix):
+        cross_validated.append(clf)
+        log_cross_val_auc(clf, X, y, cv_splits, log_prefix)
+
+    monkeypatch.setattr(training, "log_cross_val_auc", log)
+    ep.train_fn(ep.parse_args(sys_args))
+    # the preprocessor is fit within each split, rather than to all data
+    assert len(cross_validated) == 1
+    assert isinstance(cross_validated[0], Pipeline)
+    assert cross_validated[0].steps[0][0] == "preprocessor"
+    assert "train_auc_cv" in capsys.readouterr().out
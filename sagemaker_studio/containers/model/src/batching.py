@@ -0,0 +1,140 @@
+"""
+BATCHING: coalesces concurrent requests into batches, so that they share a
+single vectorized call (preprocessing, classifier and explainer).
+
+Disabled unless the BATCH_MAX_RECORDS environment variable is set (to the
+maximum number of records in a batch). BATCH_MAX_WAIT_MS sets the maximum
+time spent waiting for more requests (default 2 milliseconds).
+"""
+from collections import deque
+import os
+import threading
+import time
+
+
+DEFAULT_MAX_WAIT_MS = 2.
+
+
+def from_environment(function):
+    """
+    Coalescer for `function` configured by environment variables, or None
+    when not configured.
+    """
+    max_batch_size = os.environ.get("BATCH_MAX_RECORDS")
+    if not max_batch_size:
+        return None
+    max_wait_ms = float(os.environ.get("BATCH_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS))
+    return Coalescer(function, int(max_batch_size), max_wait_ms)
+
+
+class Pending:
+    def __init__(self, key, records):
+        self.key = key
+        self.records = records
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    """
+    Requests (lists of records) with the same key are run together, by
+    `function(key, requests)` returning one result per request, and each
+    caller waits for its own result.
+
+    Requests that arrive while a batch is running are taken together by the
+    next batch, so a request that's alone never waits. When more than one
+    request is queued (i.e. under load), the batch also waits up to
+    `max_wait_ms` for others, until it has `max_batch_size` records.
+    """
+    def __init__(self, function, max_batch_size, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        assert max_batch_size > 0, "max_batch_size should be positive."
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._worker = None
+        self._closed = False
+
+    def submit(self, key, records):
+        pending = Pending(key, records)
+        with self._condition:
+            self._start()
+            self._queue.append(pending)
+            self._condition.notify_all()
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        """
+        Stops the worker once queued requests are done (e.g. when the model
+        is unloaded). Later requests start it again.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _start(self):
+        # threads don't survive a fork, so the worker is (re)started lazily
+        self._closed = False
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._work, daemon=True)
+            self._worker.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                batch = self._take()
+            if batch is None:
+                return
+            self._run(batch)
+
+    def _take(self):
+        while not self._queue:
+            if self._closed:
+                # so the next request starts a new worker
+                self._worker = None
+                return None
+            self._condition.wait()
+        first = self._queue.popleft()
+        batch = [first]
+        size = len(first.records)
+        contended = len(self._queue) > 0
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            size = self._take_same_key(batch, size)
+            remaining = deadline - time.monotonic()
+            if not contended or size >= self.max_batch_size or remaining <= 0:
+                return batch
+            self._condition.wait(remaining)
+
+    def _take_same_key(self, batch, size):
+        key = batch[0].key
+        queue = deque()
+        for pending in self._queue:
+            fits = size + len(pending.records) <= self.max_batch_size
+            if pending.key == key and fits:
+                batch.append(pending)
+                size += len(pending.records)
+            else:
+                queue.append(pending)
+        self._queue = queue
+        return size
+
+    def _run(self, batch):
+        try:
+            results = self.function(batch[0].key, [p.records for p in batch])
+            for pending, result in zip(batch, results):
+                pending.result = result
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].error = error
+            else:
+                # one failing request shouldn't fail the others
+                for pending in batch:
+                    self._run([pending])
+        for pending in batch:
+            pending.event.set()
@@ -0,0 +1,136 @@
+"""
+BUNDLES: a single file with everything needed to serve a model (schemas,
+compiled preprocessor and compiled trees), that's loaded by memory mapping,
+so worker processes share its pages and loading doesn't rebuild anything.
+
+Layout: MAGIC, then the version and header length (as little endian
+uint32), then the JSON header, then the data of each array (each aligned to
+ALIGNMENT bytes). The header gives the metadata, the dtype, shape and offset
+of each array, and a SHA-256 checksum of the rest of the header (as
+canonical JSON) followed by everything after the header.
+"""
+import hashlib
+import json
+import mmap
+from pathlib import Path
+import struct
+import numpy as np
+
+from package.data import schemas
+from preprocessing import CompiledPreprocessor
+from trees import TreeEnsemble
+
+
+FILENAME = "model.bundle"
+MAGIC = b"MODELBDL"
+VERSION = 2  # 1 didn't checksum the header
+ALIGNMENT = 64
+PREFIX = struct.Struct("<8sII")  # magic, version, header length
+
+
+def save(filepath, metadata, arrays):
+    """
+    Writes `metadata` (JSON compatible) and `arrays` (dict of NumPy arrays)
+    to a bundle file.
+    """
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        assert array.dtype != object, "Object arrays can't be bundled."
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset
+        }
+        offset += array.nbytes
+    data = bytearray(-(-offset // ALIGNMENT) * ALIGNMENT)
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        start = layout[name]['offset']
+        data[start:start + array.nbytes] = array.tobytes()
+    header = {'metadata': metadata, 'arrays': layout}
+    header['checksum'] = checksum(header, data)
+    header = json.dumps(header).encode()
+    # pad header, so array data is aligned in the file too
+    header_length = -(-(PREFIX.size + len(header)) // ALIGNMENT) * ALIGNMENT - PREFIX.size  # noqa
+    header = header.ljust(header_length)
+    Path(filepath).parent.mkdir(exist_ok=True, parents=True)
+    with open(filepath, "wb") as openfile:
+        openfile.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        openfile.write(header)
+        openfile.write(data)
+
+
+def checksum(header, data):
+    """
+    SHA-256 of the header (without its checksum) as canonical JSON, and of
+    the data, so that an edited header doesn't load silently either.
+    """
+    header = {key: value for key, value in header.items() if key != 'checksum'}
+    canonical = json.dumps(header, sort_keys=True, separators=(',', ':'))
+    digest = hashlib.sha256(canonical.encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def load(filepath, verify=True):
+    """
+    Metadata, arrays (read-only, memory mapped) and checksum of a bundle file.
+    Raises a ValueError for unknown files, versions or checksums.
+    """
+    with open(filepath, "rb") as openfile:
+        buffer = mmap.mmap(openfile.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, header_length = PREFIX.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("{} isn't a model bundle.".format(filepath))
+    if version != VERSION:
+        raise ValueError("Unsupported model bundle version: {}.".format(version))
+    header = json.loads(bytes(buffer[PREFIX.size:PREFIX.size + header_length]))
+    data_start = PREFIX.size + header_length
+    if verify:
+        if checksum(header, memoryview(buffer)[data_start:]) != header.get('checksum'):
+            raise ValueError("Model bundle checksum doesn't match.")
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        dtype = np.dtype(layout['dtype'])
+        shape = tuple(layout['shape'])
+        arrays[name] = np.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=int(np.prod(shape)),
+            offset=data_start + layout['offset']
+        ).reshape(shape)
+    return header['metadata'], arrays, header['checksum']
+
+
+def save_model_bundle(filepath, data_schema, features_schema, compiled_preprocessor, trees):
+    tree_arrays, tree_constants = trees.to_arrays()
+    metadata = {
+        'data_schema': data_schema.json_schema,
+        'features_schema': features_schema.json_schema,
+        'preprocessor': compiled_preprocessor.to_dict(),
+        'trees': tree_constants
+    }
+    arrays = {"trees/" + name: array for name, array in tree_arrays.items()}
+    save(filepath, metadata, arrays)
+
+
+def load_model_bundle(filepath, verify=True):
+    """
+    Data schema, features schema, compiled preprocessor, trees and checksum
+    of a model bundle file.
+    """
+    metadata, arrays, checksum = load(filepath, verify)
+    tree_arrays = {
+        name[len("trees/"):]: array for name, array in arrays.items()
+        if name.startswith("trees/")
+    }
+    return (
+        schemas.Schema(metadata['data_schema']),
+        schemas.Schema(metadata['features_schema']),
+        CompiledPreprocessor.from_dict(metadata['preprocessor']),
+        TreeEnsemble.from_arrays(tree_arrays, metadata['trees']),
+        checksum
+    )
@@ -0,0 +1,13 @@
+"""
+ESTIMATORS: custom sklearn estimators used in the preprocessor, in their own
+module so that importing them (e.g. to unpickle) doesn't import training.
+"""
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+class AsTypeFloat32(BaseEstimator, TransformerMixin):
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        return X.astype("float32")
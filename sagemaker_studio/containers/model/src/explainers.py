@@ -0,0 +1,53 @@
+"""
+EXPLAINER: read-only wrapper around the native TreeSHAP engine (see
+`trees.py`), safe to share between the threads of a model server.
+"""
+from trees import TreeEnsemble
+
+
+class Explainer:
+    """
+    Explains the positive class of a binary LightGBM classifier, in log-odds.
+
+    The classifier is flattened into arrays once, and the expected value is
+    resolved at creation. Computing explanations never changes any state,
+    so a single instance can serve concurrent requests.
+    """
+    def __init__(self, classifier):
+        self._trees = TreeEnsemble.from_classifier(classifier)
+        self._expected_value = self._trees.expected_value
+
+    @classmethod
+    def from_trees(cls, trees):
+        explainer = cls.__new__(cls)
+        explainer._trees = trees
+        explainer._expected_value = trees.expected_value
+        return explainer
+
+    @property
+    def expected_value(self):
+        return self._expected_value
+
+    def margin(self, shap_values):
+        """
+        Margin (in log-odds) derived from SHAP values (or SHAP interaction
+        values), instead of a second pass through the trees: it's the
+        expected value plus all SHAP values.
+        """
+        shap_values = shap_values.reshape(shap_values.shape[0], -1)
+        return self._expected_value + shap_values.sum(axis=1)
+
+    def predict_margin(self, features):
+        return self._trees.predict_margin(features)
+
+    def margin_to_proba(self, margins):
+        return self._trees.margin_to_proba(margins)
+
+    def shap_values(self, features):
+        return self._trees.shap_values(features)
+
+    def approximate_shap_values(self, features):
+        return self._trees.approximate_shap_values(features)
+
+    def shap_interaction_values(self, features, pairs=None):
+        return self._trees.shap_interaction_values(features, pairs=pairs)
@@ -0,0 +1,51 @@
+"""
+GROUPING: maps features back to the data field they come from (e.g. the
+one-hot features 'credit__purpose__car', 'credit__purpose__education', ...
+to 'credit__purpose'), so that SHAP values can be summed by field.
+"""
+import numpy as np
+
+
+class FieldGroups:
+    """
+    Sparse (fields, features) membership matrix, where each feature belongs
+    to a single field. Features are matched to the data field with the
+    longest title that's either the feature's title, or a prefix of it
+    followed by `separator`. Features without a field are their own field.
+    """
+    def __init__(self, fields, matrix):
+        self.fields = fields
+        self.matrix = matrix
+
+    @classmethod
+    def from_schemas(cls, data_schema, features_schema, separator="__"):
+        # scipy is a dependency of sklearn and LightGBM, only imported here
+        from scipy import sparse
+
+        fields = list(data_schema.item_titles)
+        field_idxs = {field: idx for idx, field in enumerate(fields)}
+        prefixes = sorted(fields, key=len, reverse=True)
+        feature_fields = []
+        for feature in features_schema.item_titles:
+            field = next(
+                (p for p in prefixes if feature == p or feature.startswith(p + separator)),
+                None
+            )
+            if field is None:
+                field = feature
+                field_idxs[field] = len(fields)
+                fields.append(field)
+            feature_fields.append(field_idxs[field])
+        num_features = len(feature_fields)
+        matrix = sparse.csr_matrix(
+            (np.ones(num_features), (feature_fields, np.arange(num_features))),
+            shape=(len(fields), num_features)
+        )
+        return cls(fields, matrix)
+
+    def sum(self, values):
+        """
+        Sums of `values` (with a row per record, and a column per feature)
+        by field, with a row per record and a column per field.
+        """
+        return np.asarray(self.matrix @ np.asarray(values).T).T
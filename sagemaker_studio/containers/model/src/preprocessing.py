@@ -0,0 +1,141 @@
+"""
+PREPROCESSING: the fitted preprocessor (see `training.create_preprocessor`)
+compiled into direct lookups, so that records can be written straight into
+feature vectors, without an object array or the ColumnTransformer.
+
+sklearn is only imported to compile a preprocessor, so it isn't needed to
+use a compiled preprocessor (e.g. from a model bundle).
+"""
+import numpy as np
+
+
+class CompiledPreprocessor:
+    """
+    Maps each numerical item to its feature slot, and each (categorical item,
+    category) to its one-hot feature slot. Unknown categories are ignored,
+    like the OneHotEncoder with handle_unknown='ignore'.
+
+    Items are given by (title, idx), so records can be dicts or lists.
+    """
+    def __init__(self, numerical, categorical, num_features, dtype):
+        self.numerical = numerical  # list of (title, idx, slot)
+        self.categorical = categorical  # list of (title, idx, {category: slot})
+        self.num_features = num_features
+        self.dtype = dtype
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor, data_schema):
+        """
+        Compiled preprocessor, or None when the preprocessor contains steps
+        that can't be compiled (in which case sklearn should be used).
+        """
+        from sklearn.compose import ColumnTransformer
+        from estimators import AsTypeFloat32
+
+        if not isinstance(preprocessor, ColumnTransformer) or preprocessor.sparse_output_:
+            return None
+        titles = data_schema.item_titles
+        numerical, categorical = [], []
+        dtypes = [np.float32]
+        slot = 0
+        for name, transformer, idxs in preprocessor.transformers_:
+            if transformer == 'drop' or len(idxs) == 0:
+                continue
+            if not all(isinstance(idx, (int, np.integer)) for idx in idxs):
+                return None
+            if isinstance(transformer, AsTypeFloat32):
+                for idx in idxs:
+                    numerical.append((titles[idx], idx, slot))
+                    slot += 1
+            elif cls._is_compilable_encoder(transformer):
+                for idx, categories in zip(idxs, transformer.categories_):
+                    slots = {}
+                    for category in categories:
+                        slots[category] = slot
+                        slot += 1
+                    categorical.append((titles[idx], idx, slots))
+                dtypes.append(transformer.dtype)
+            else:
+                return None
+        return cls(numerical, categorical, slot, np.result_type(*dtypes))
+
+    def to_dict(self):
+        """
+        JSON compatible representation (categories as [category, slot] pairs).
+        """
+        return {
+            'numerical': [list(item) for item in self.numerical],
+            'categorical': [
+                [title, idx, [[to_json_value(c), s] for c, s in slots.items()]]
+                for title, idx, slots in self.categorical
+            ],
+            'num_features': self.num_features,
+            'dtype': np.dtype(self.dtype).name
+        }
+
+    @classmethod
+    def from_dict(cls, compiled):
+        return cls(
+            numerical=[tuple(item) for item in compiled['numerical']],
+            categorical=[
+                (title, idx, {category: slot for category, slot in slots})
+                for title, idx, slots in compiled['categorical']
+            ],
+            num_features=compiled['num_features'],
+            dtype=np.dtype(compiled['dtype'])
+        )
+
+    @staticmethod
+    def _is_compilable_encoder(transformer):
+        from sklearn.preprocessing import OneHotEncoder
+
+        return (
+            isinstance(transformer, OneHotEncoder)
+            and transformer.handle_unknown == 'ignore'
+            and transformer.drop_idx_ is None
+            and not getattr(transformer, '_infrequent_enabled', False)
+        )
+
+    def transform(self, records):
+        """
+        Features of records, with a row per record (same values and dtype as
+        the ColumnTransformer).
+        """
+        features = np.zeros((len(records), self.num_features), dtype=np.float32)
+        for row, record in zip(features, records):
+            by_title = isinstance(record, dict)
+            for title, idx, slot in self.numerical:
+                row[slot] = record[title] if by_title else record[idx]
+            for title, idx, slots in self.categorical:
+                slot = slots.get(record[title] if by_title else record[idx])
+                if slot is not None:
+                    row[slot] = 1.
+        return features.astype(self.dtype)
+
+    def transform_columns(self, columns):
+        """
+        Features of typed columns (see `Schema.transform_columns`), with each
+        column written at once: categories are mapped to slots once per
+        distinct category, and records by their category codes.
+        """
+        num_records = len(columns[0]) if columns else 0
+        features = np.zeros((num_records, self.num_features), dtype=np.float32)
+        for title, idx, slot in self.numerical:
+            features[:, slot] = columns[idx]
+        for title, idx, slots in self.categorical:
+            column = columns[idx]
+            category_slots = np.array(
+                [slots.get(category, -1) for category in column.categories], dtype=np.int64
+            )
+            record_slots = category_slots[column.codes]
+            known = record_slots >= 0
+            features[np.flatnonzero(known), record_slots[known]] = 1.
+        return features.astype(self.dtype)
+
+    def transform_record(self, record):
+        return self.transform([record])
+
+
+def to_json_value(value):
+    # categories can be NumPy scalars
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,81 @@
+"""
+REASON CODES: adverse action reasons of a declined application, i.e. the
+data fields that increased the predicted probability of default the most.
+
+Training writes a table of reason codes (one per data field, with the item
+description as reason), that can be edited to reword the reasons. At serving
+time, SHAP values are summed by field (see `grouping.py`) and the fields
+with the largest positive sums are returned with their code and reason.
+"""
+import json
+from pathlib import Path
+import numpy as np
+
+
+FILENAME = "reason_codes.json"
+
+
+def create_table(data_schema):
+    """
+    Reason code of each data field, with the item description as reason.
+    """
+    table = []
+    for idx, item in enumerate(data_schema.items):
+        table.append({
+            "code": "R{:02d}".format(idx + 1),
+            "field": item["title"],
+            "reason": item.get("description", item["title"]).strip().rstrip(".")
+        })
+    return table
+
+
+def save_table(table, filepath):
+    assert isinstance(filepath, Path)
+    filepath.parent.mkdir(exist_ok=True, parents=True)
+    with open(filepath, "w") as openfile:
+        json.dump(table, openfile, indent=4)
+
+
+def load_table(filepath):
+    with open(filepath, "r") as openfile:
+        return json.load(openfile)
+
+
+class ReasonCodes:
+    """
+    Codes and reasons of the fields of FieldGroups (in the same order).
+    Fields that aren't in the table get their field name as code and reason.
+    """
+    def __init__(self, table, fields):
+        by_field = {row["field"]: row for row in table}
+        self.codes = [by_field.get(field, {}).get("code", field) for field in fields]
+        self.reasons = [by_field.get(field, {}).get("reason", field) for field in fields]
+
+    @classmethod
+    def from_model_dir(cls, model_dir, data_schema, fields):
+        """
+        Reason codes of the table saved by training, or else created from
+        the data schema (e.g. for models trained before reason codes).
+        """
+        filepath = Path(model_dir, FILENAME)
+        if filepath.exists():
+            table = load_table(filepath)
+        else:
+            table = create_table(data_schema)
+        return cls(table, fields)
+
+    def to_columns(self):
+        return {"codes": self.codes, "reasons": self.reasons}
+
+
+def top_k_reasons(grouped_values, k):
+    """
+    Field indexes and values of the (up to) k fields with the largest
+    positive grouped SHAP values of each record, in decreasing order. Rows
+    are padded with index -1 (and value 0) when fewer fields are positive.
+    """
+    k = min(k, grouped_values.shape[1])
+    idxs = np.argsort(-grouped_values, axis=1, kind="stable")[:, :k]
+    values = np.take_along_axis(grouped_values, idxs, axis=1)
+    positive = values > 0
+    return np.where(positive, idxs, -1), np.where(positive, values, 0.)
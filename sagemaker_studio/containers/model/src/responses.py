@@ -0,0 +1,254 @@
+"""
+RESPONSES: columnar results of a request, rendered as JSON (one object per
+record) or as a binary NumPy archive (one contiguous array per entity).
+"""
+import io
+import json
+import numpy as np
+
+
+JSON_CONTENT_TYPE = "application/json"
+JSONLINES_CONTENT_TYPE = "application/jsonlines"
+NPZ_CONTENT_TYPE = "application/x-npz"
+# request only (records without header, in data schema order)
+CSV_CONTENT_TYPE = "text/csv"
+ACCEPT_TYPES = set([JSON_CONTENT_TYPE, JSONLINES_CONTENT_TYPE, NPZ_CONTENT_TYPE])
+# nested keys are flattened with this separator in binary responses
+KEY_SEPARATOR = "/"
+# columns that are the same for all records (i.e. without a record axis)
+SHARED_KEYS = set([
+    "descriptions",
+    "explanation/expected_value",
+    "explanation/fields",
+    "explanation/reason_table"
+])
+
+
+class Predictions:
+    """
+    Results for all records of a request, stored by entity rather than by
+    record. Arrays have records as first axis. `columns` can contain:
+
+    * 'data': list of records (as given in the request).
+    * 'features': array of feature values.
+    * 'descriptions': dict of feature descriptions (same for all records).
+    * 'prediction': array of positive class probabilities.
+    * 'explanation': dict with 'expected_value' (same for all records),
+      and optionally 'shap_values', 'shap_values_topk' (a dict of 'idxs',
+      'values' and 'other_features' arrays), 'shap_values_grouped' (with
+      'fields', the field names, same for all records), 'reason_codes' (a
+      dict of 'idxs' and 'values' arrays, with 'fields' and 'reason_table',
+      a dict of 'codes' and 'reasons' of each field, same for all records),
+      'shap_interaction_values' and 'shap_interactions_topk' (a dict of
+      'rows', 'columns', 'values' and optionally 'diagonal' arrays).
+
+    `errors` gives the exception of each record that failed (None for the
+    others): failed records are responded to with an error object, and
+    their rows of the columns are placeholders (zeros, NaN or None).
+    """
+    def __init__(self, columns, feature_names, num_records, batch=True, timings=None,
+                 errors=None):
+        self.columns = columns
+        self.feature_names = feature_names
+        self.num_records = num_records
+        self.batch = batch
+        # stage timings of the request (see `timing.py`), if enabled
+        self.timings = timings
+        self.errors = errors
+
+    def __len__(self):
+        return self.num_records
+
+    def take(self, start, stop, batch=True):
+        """
+        Predictions of records `start` to `stop` (e.g. to split a batch).
+        """
+        columns = take_columns(self.columns, start, stop)
+        errors = self.errors[start:stop] if self.errors is not None else None
+        return Predictions(columns, self.feature_names, stop - start, batch, errors=errors)
+
+    def records(self):
+        """
+        One JSON compatible dict per record, in the same order as the request.
+        """
+        records = [{} for _ in range(self.num_records)]
+        columns = self.columns
+        feature_names = self.feature_names
+        if 'data' in columns:
+            for record, data in zip(records, columns['data']):
+                record['data'] = data
+        if 'features' in columns:
+            for record, values in zip(records, columns['features'].tolist()):
+                record['features'] = {k: v for k, v in zip(feature_names, values)}
+        if 'descriptions' in columns:
+            for record in records:
+                record['descriptions'] = columns['descriptions']
+        if 'prediction' in columns:
+            for record, prediction in zip(records, columns['prediction'].tolist()):
+                record['prediction'] = prediction
+        if 'explanation' in columns:
+            explanation_columns = columns['explanation']
+            explanations = [{} for _ in range(self.num_records)]
+            for explanation in explanations:
+                explanation['expected_value'] = explanation_columns['expected_value']
+            if 'shap_values' in explanation_columns:
+                shap_values = explanation_columns['shap_values'].tolist()
+                for explanation, values in zip(explanations, shap_values):
+                    explanation['shap_values'] = {k: v for k, v in zip(feature_names, values)}
+            if 'shap_values_topk' in explanation_columns:
+                topk = explanation_columns['shap_values_topk']
+                rows = zip(
+                    topk['idxs'].tolist(),
+                    topk['values'].tolist(),
+                    topk['other_features'].tolist()
+                )
+                for explanation, (idxs, values, other_features) in zip(explanations, rows):
+                    explanation['shap_values_topk'] = {
+                        'features': [feature_names[idx] for idx in idxs],
+                        'values': values,
+                        'other_features': other_features
+                    }
+            if 'shap_values_grouped' in explanation_columns:
+                fields = explanation_columns['fields']
+                shap_values = explanation_columns['shap_values_grouped'].tolist()
+                for explanation, values in zip(explanations, shap_values):
+                    explanation['shap_values_grouped'] = {k: v for k, v in zip(fields, values)}
+            if 'reason_codes' in explanation_columns:
+                fields = explanation_columns['fields']
+                table = explanation_columns['reason_table']
+                reason_codes = explanation_columns['reason_codes']
+                rows = zip(reason_codes['idxs'].tolist(), reason_codes['values'].tolist())
+                for explanation, (idxs, values) in zip(explanations, rows):
+                    explanation['reason_codes'] = [
+                        {
+                            'code': table['codes'][idx],
+                            'reason': table['reasons'][idx],
+                            'field': fields[idx],
+                            'value': value
+                        }
+                        for idx, value in zip(idxs, values) if idx >= 0
+                    ]
+            if 'shap_interaction_values' in explanation_columns:
+                interaction_values = explanation_columns['shap_interaction_values'].tolist()
+                for explanation, values in zip(explanations, interaction_values):
+                    explanation['shap_interaction_values'] = {
+                        'labels': feature_names,
+                        'values': values
+                    }
+            if 'shap_interactions_topk' in explanation_columns:
+                topk = {
+                    k: v.tolist() for k, v in explanation_columns['shap_interactions_topk'].items()
+                }
+                for idx, explanation in enumerate(explanations):
+                    explanation['shap_interactions_topk'] = {'labels': feature_names}
+                    for key, values in topk.items():
+                        explanation['shap_interactions_topk'][key] = values[idx]
+            for record, explanation in zip(records, explanations):
+                record['explanation'] = explanation
+        for idx, error in enumerate(self.errors or []):
+            if error is not None:
+                record = {'error': error_object(error)}
+                if 'data' in columns:
+                    record['data'] = columns['data'][idx]
+                records[idx] = record
+        return records
+
+    def arrays(self):
+        """
+        Flat dict of NumPy arrays: floats as float32, with records as first
+        axis for batch requests. Feature names (and descriptions) are only
+        included once, and records given in the request as JSON strings.
+        """
+        arrays = {'feature_names': np.array(self.feature_names, dtype=np.str_)}
+        columns = dict(self.columns)
+        if 'data' in columns:
+            columns['data'] = np.array(
+                [json.dumps(record) for record in columns['data']], dtype=np.str_
+            )
+        if 'descriptions' in columns:
+            descriptions = columns['descriptions']
+            columns['descriptions'] = np.array(
+                [descriptions.get(name, '') for name in self.feature_names],
+                dtype=np.str_
+            )
+        for key, value in flatten(columns):
+            value = np.asarray(value)
+            if value.dtype.kind == 'f':
+                value = value.astype(np.float32)
+            if not self.batch and not is_shared(key):
+                value = value[0]
+            arrays[key] = value
+        if self.errors is not None and any(error is not None for error in self.errors):
+            errors = np.array([
+                json.dumps(error_object(error)) if error is not None else ''
+                for error in self.errors
+            ], dtype=np.str_)
+            arrays['error'] = errors if self.batch else errors[0]
+        return arrays
+
+    def to_json(self):
+        records = self.records()
+        return json.dumps(records if self.batch else records[0])
+
+    def to_jsonlines(self):
+        # one line per record, so batch transform can assemble by line
+        return "\n".join(json.dumps(record) for record in self.records())
+
+    def to_npz(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, **self.arrays())
+        return buffer.getvalue()
+
+
+def is_shared(key):
+    # also nested keys of shared columns (e.g. 'explanation/reason_table/codes')
+    return any(
+        key == shared or key.startswith(shared + KEY_SEPARATOR) for shared in SHARED_KEYS
+    )
+
+
+def error_object(error):
+    # e.g. jsonschema's ValidationError has a shorter message than str(error)
+    message = getattr(error, 'message', None) or str(error)
+    return {'type': type(error).__name__, 'message': message}
+
+
+def flatten(columns, prefix=""):
+    for key, value in columns.items():
+        if isinstance(value, dict):
+            yield from flatten(value, prefix + key + KEY_SEPARATOR)
+        else:
+            yield prefix + key, value
+
+
+def take_columns(columns, start, stop, prefix=""):
+    taken = {}
+    for key, value in columns.items():
+        if prefix + key in SHARED_KEYS:
+            taken[key] = value
+        elif isinstance(value, dict):
+            taken[key] = take_columns(value, start, stop, prefix + key + KEY_SEPARATOR)
+        else:
+            taken[key] = value[start:stop]
+    return taken
+
+
+def scatter_rows(value, idxs, num_records):
+    """
+    Value with `num_records` rows, where rows `idxs` are those of `value`
+    (e.g. results of the valid records of a batch) and others are zeros,
+    NaN (for floats) or None (for lists).
+    """
+    if isinstance(value, dict):
+        return {k: scatter_rows(v, idxs, num_records) for k, v in value.items()}
+    if isinstance(value, list):
+        scattered = [None] * num_records
+        for idx, row in zip(idxs, value):
+            scattered[idx] = row
+        return scattered
+    value = np.asarray(value)
+    scattered = np.zeros((num_records,) + value.shape[1:], dtype=value.dtype)
+    if value.dtype.kind == 'f':
+        scattered.fill(np.nan)
+    scattered[idxs] = value
+    return scattered
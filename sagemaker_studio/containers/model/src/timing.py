@@ -0,0 +1,159 @@
+"""
+TIMING: per-request stage timings (wall time) and payload sizes, printed as
+structured (JSON) log lines and kept in in-process histograms.
+
+Disabled unless the TIMING environment variable is set to 'true', in which
+case no Timings are created and instrumented code skips timing entirely.
+
+Similarly, STARTUP_PROFILE set to 'true' times the imports of the entry
+point and the phases of `model_fn`, printed once the model is loaded.
+"""
+from collections import deque
+import json
+import os
+import signal
+import threading
+import time
+import numpy as np
+
+
+ENABLED = os.environ.get("TIMING", "false").lower() == "true"
+# Server-Timing header, if the server can add headers to the response
+HEADER = "Server-Timing"
+# number of most recent samples kept for each stage
+HISTOGRAM_SAMPLES = 10000
+PERCENTILES = [50, 95, 99]
+
+
+class Histograms:
+    """
+    Most recent samples of each stage's wall time (in milliseconds), shared
+    by all request threads.
+    """
+    def __init__(self, samples=HISTOGRAM_SAMPLES):
+        self._samples = samples
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stages):
+        with self._lock:
+            for name, milliseconds in stages.items():
+                if name not in self._stages:
+                    self._stages[name] = deque(maxlen=self._samples)
+                self._stages[name].append(milliseconds)
+
+    def percentiles(self):
+        with self._lock:
+            stages = {name: list(samples) for name, samples in self._stages.items()}
+        summary = {}
+        for name, samples in stages.items():
+            values = np.percentile(samples, PERCENTILES)
+            summary[name] = {'count': len(samples)}
+            for percentile, value in zip(PERCENTILES, values):
+                summary[name]['p{}'.format(percentile)] = round(float(value), 3)
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._stages = {}
+
+
+HISTOGRAMS = Histograms()
+# functions returning process-wide counters (e.g. cache hits), by name
+COUNTERS = {}
+COUNTERS_LOCK = threading.Lock()
+
+
+class Timings:
+    """
+    Wall time (in milliseconds) of each stage of a single request, and sizes
+    of its payloads. Stages with the same name are accumulated.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.sizes = {}
+
+    def time(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            milliseconds = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0.) + milliseconds
+
+    def size(self, name, value):
+        self.sizes[name] = value
+
+    def header(self):
+        return ", ".join(
+            "{};dur={:.3f}".format(name, milliseconds)
+            for name, milliseconds in self.stages.items()
+        )
+
+    def log(self, label="timings"):
+        line = {
+            'stages': {k: round(v, 3) for k, v in self.stages.items()},
+            'sizes': self.sizes
+        }
+        print("{}: {}".format(label, json.dumps(line)), flush=True)
+
+    def finish(self):
+        self.log()
+        HISTOGRAMS.add(self.stages)
+
+
+# cold start profile of the process (or None)
+STARTUP = None
+if os.environ.get("STARTUP_PROFILE", "false").lower() == "true":
+    STARTUP = Timings()
+
+
+def start():
+    """
+    Timings for a new request, or None when timing is disabled.
+    """
+    return Timings() if ENABLED else None
+
+
+def timed(timings, name, function, *args, **kwargs):
+    if timings is None:
+        return function(*args, **kwargs)
+    return timings.time(name, function, *args, **kwargs)
+
+
+def register_counters(name, counters):
+    with COUNTERS_LOCK:
+        COUNTERS[name] = counters
+
+
+def unregister_counters(name, counters):
+    """
+    Unregisters `counters`, unless other counters were registered with the
+    same name since (e.g. by a reload of the same model).
+    """
+    with COUNTERS_LOCK:
+        if COUNTERS.get(name) == counters:
+            del COUNTERS[name]
+
+
+def dump():
+    """
+    Prints (and returns) p50/p95/p99 wall times of each stage so far, and
+    the current value of registered counters.
+    """
+    summary = {
+        'stages': HISTOGRAMS.percentiles(),
+        # copied, since counters of models can be (un)registered meanwhile
+        'counters': {name: counters() for name, counters in list(COUNTERS.items())}
+    }
+    print("timing histograms: {}".format(json.dumps(summary)), flush=True)
+    return summary
+
+
+def dump_on_signal(signum=signal.SIGUSR1):
+    """
+    Dumps the histograms whenever the process receives `signum` (e.g. with
+    `kill -USR1 <pid>`). Only possible from the main thread.
+    """
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signum, lambda signum, frame: dump())
@@ -42,7 +42,7 @@ def read_csv_dataset(folder, schema):
     return ndarray
 
 
-def read_json_dataset(folder, schema):
+def read_json_records(folder):
     filepaths = Path(folder).glob("*")
     if type(filepaths) in set(["str", Path]):
         filepaths = [filepaths]
@@ -50,9 +50,12 @@ def read_json_dataset(folder, schema):
     for filepath in filepaths:
         with open(filepath) as lines:
             for line in lines:
-                if line:
-                    record = json.loads(line)
-                    record = schema.transform(record)
-                    records.append(record)
-    ndarray = np.array(records)
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def read_json_dataset(folder, schema):
+    records = read_json_records(folder)
+    ndarray = schema.transform_batch(records)
     return ndarray
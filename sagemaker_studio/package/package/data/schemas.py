@@ -1,10 +1,47 @@
 import json
 from pathlib import Path
 from jsonschema import validate, Draft4Validator
+from jsonschema.exceptions import ValidationError
 import copy
 import numpy as np
 
 
+# NumPy types used to convert columns of strings (e.g. from CSV)
+STRING_TO_NUMPY_TYPES = {
+    "number": np.float64,
+    "integer": np.int64,
+    "string": np.str_
+}
+BOOLEAN_STRINGS = {"true": True, "false": False}
+# Python types (exactly, e.g. bool isn't a "number") that JSON types accept
+JSON_TO_PYTHON_TYPES = {
+    "number": {int, float},
+    "integer": {int},
+    "string": {str},
+    "boolean": {bool},
+    "null": {type(None)}
+}
+# keywords that the compiled checks of `Schema` enforce (or that don't validate)
+ITEM_KEYWORDS = {"title", "type", "description"}
+ARRAY_KEYWORDS = {"$schema", "type", "items", "minItems", "maxItems", "title", "description"}
+
+
+class CategoricalColumn:
+    """
+    Values of a categorical item as integer codes (int32), and the distinct
+    values (in order of first appearance) that the codes index.
+    """
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.codes)
+
+    def values(self):
+        return np.array(self.categories, dtype=object)[self.codes]
+
+
 def from_json_schema(filepath):
     with open(filepath, "r") as openfile:
         json_schema = json.load(openfile)
@@ -16,19 +53,96 @@ class Schema:
         self._validate_schema(json_schema)
         self._schema = json_schema
         self._object_schema = self._to_object_schema(json_schema)
+        self._compile_checks(json_schema)
 
     def validate(self, instance):
+        """
+        Validates with the compiled checks, and only with jsonschema when
+        they fail (to raise its detailed error, or accept what they don't).
+        """
+        if not self._is_valid(instance):
+            self._validate_jsonschema(instance)
+
+    def validate_batch(self, instances):
+        """
+        Exception of each instance that isn't valid, or None if it's valid.
+        Types are checked an item at a time across instances, and only the
+        instances that fail are validated again with jsonschema.
+        """
+        checked = []
+        if self._item_types is not None:
+            checked = [idx for idx, instance in enumerate(instances) if self._has_items(instance)]
+        suspects = set(range(len(instances))).difference(checked)
+        for pos, title in enumerate(self._titles if checked else []):
+            types = self._item_types[pos]
+            value_types = [
+                type(instances[idx][title] if type(instances[idx]) is dict else instances[idx][pos])  # noqa
+                for idx in checked
+            ]
+            if not types.issuperset(value_types):
+                suspects.update(idx for idx, t in zip(checked, value_types) if t not in types)
+        errors = [None] * len(instances)
+        for idx in sorted(suspects):
+            try:
+                self._validate_jsonschema(instances[idx])
+            except ValidationError as error:
+                errors[idx] = error
+        return errors
+
+    def _validate_jsonschema(self, instance):
         if isinstance(instance, list):
             validate(instance, self._schema)
         elif isinstance(instance, dict):
             validate(instance, self._object_schema)
         else:
-            raise TypeError('instance should be list or dict.')
+            # a schema error, rather than a TypeError (i.e. a bug)
+            raise ValidationError('instance should be list or dict.')
+
+    def _compile_checks(self, schema):
+        """
+        Allowed Python types of each item, or None when items use keywords
+        (or types) that the compiled checks don't enforce. Lists are only
+        checked when the array keywords allow exactly one value per item.
+        """
+        self._titles = [item["title"] for item in schema["items"]]
+        self._title_set = set(self._titles)
+        self._item_types = []
+        for item in schema["items"]:
+            item_types = item["type"] if isinstance(item["type"], list) else [item["type"]]
+            if not ITEM_KEYWORDS.issuperset(item) or not JSON_TO_PYTHON_TYPES.keys() >= set(item_types):  # noqa
+                self._item_types = None
+                break
+            self._item_types.append(set().union(*(JSON_TO_PYTHON_TYPES[t] for t in item_types)))
+        num_items = len(self._titles)
+        self._check_lists = (
+            self._item_types is not None
+            and ARRAY_KEYWORDS.issuperset(schema)
+            and schema.get("minItems", 0) <= num_items <= schema.get("maxItems", num_items)
+        )
+
+    def _has_items(self, instance):
+        # same keys as the items (or one value per item), before type checks
+        if type(instance) is dict:
+            return instance.keys() == self._title_set
+        if type(instance) is list:
+            return self._check_lists and len(instance) == len(self._titles)
+        return False
+
+    def _is_valid(self, instance):
+        if self._item_types is None or not self._has_items(instance):
+            return False
+        if type(instance) is dict:
+            instance = [instance[title] for title in self._titles]
+        return all(type(value) in types for value, types in zip(instance, self._item_types))
 
     @staticmethod
     def _validate_schema(schema):
         Draft4Validator.check_schema(schema)
 
+    @property
+    def json_schema(self):
+        return copy.deepcopy(self._schema)
+
     @property
     def title(self):
         return self._schema["title"]
@@ -113,4 +227,61 @@ class Schema:
     def transform(self, instance):
         if isinstance(instance, dict):
             instance = [instance[title] for title in self.item_titles]
-        return np.array(instance, dtype=np.object)
+        return np.array(instance, dtype=object)
+
+    def transform_columns(self, instances):
+        """
+        Typed column of each item of the instances (dicts or lists), without
+        an intermediate object array: float32 arrays for numerical items,
+        and CategoricalColumn (integer codes) for categorical items.
+        """
+        columns = []
+        for idx, item in enumerate(self.items):
+            title = item["title"]
+            values = [
+                instance[title] if isinstance(instance, dict) else instance[idx]
+                for instance in instances
+            ]
+            if item["type"] == "string":
+                categories = {}
+                codes = [categories.setdefault(value, len(categories)) for value in values]
+                codes = np.array(codes, dtype=np.int32)
+                columns.append(CategoricalColumn(codes, list(categories)))
+            else:
+                columns.append(np.fromiter(values, dtype=np.float32, count=len(values)))
+        return columns
+
+    def parse_rows(self, rows):
+        """
+        Instances (as lists, in item order) from rows of strings (e.g. CSV
+        lines), converting each column at once to the item's type. Raises a
+        ValueError for rows of the wrong length or values of the wrong type.
+        """
+        num_items = len(self.items)
+        for row in rows:
+            if len(row) != num_items:
+                raise ValueError("Rows should have {} values, not {}.".format(num_items, len(row)))  # noqa
+        if len(rows) == 0:
+            return []
+        columns = []
+        for item, column in zip(self.items, zip(*rows)):
+            try:
+                if item["type"] == "boolean":
+                    column = [BOOLEAN_STRINGS[value.strip().lower()] for value in column]
+                else:
+                    column = np.array(column, dtype=STRING_TO_NUMPY_TYPES[item["type"]]).tolist()  # noqa
+            except (KeyError, ValueError, OverflowError):
+                # e.g. integers out of the int64 range overflow
+                raise ValueError("'{}' should be of type {}.".format(item["title"], item["type"]))  # noqa
+            columns.append(column)
+        return [list(instance) for instance in zip(*columns)]
+
+    def transform_batch(self, instances):
+        # builds the array column by column, so each item is gathered once
+        array = np.empty((len(instances), len(self.items)), dtype=object)
+        for idx, title in enumerate(self.item_titles):
+            array[:, idx] = [
+                instance[title] if isinstance(instance, dict) else instance[idx]
+                for instance in instances
+            ]
+        return array
@@ -62,6 +62,28 @@ def detailed_explanation(output):
     return explanation
 
 
+def topk_explanation(output):
+    """
+    Waterfall chart input from the 'explanation_shap_values_topk' entity:
+    the top features, and all other features combined as 'other_features'.
+    """
+    topk = output['explanation']['shap_values_topk']
+    explanation = {
+        'shap_values': topk['values'] + [topk['other_features']],
+        'expected_value': output['explanation']['expected_value'],
+        'feature_names': topk['features'] + ['other_features']
+    }
+    if 'features' in output:
+        explanation['feature_values'] = [
+            output['features'][name] for name in topk['features']
+        ] + [None]
+    if 'descriptions' in output:
+        explanation['feature_descriptions'] = [
+            output['descriptions'].get(name, '') for name in topk['features']
+        ] + ['All other features combined.']
+    return explanation
+
+
 class WaterfallChart():
     def __init__(
         self,
@@ -0,0 +1,28 @@
+import numpy as np
+
+import explaining
+from package import visuals
+
+
+def test_topk_explanation(records, model_assets):
+    request = {
+        'data': records[0],
+        'entities': [
+            'features',
+            'descriptions',
+            'explanation_shap_values',
+            'explanation_shap_values_topk'
+        ],
+        'parameters': {'explanation_shap_values_topk': '3'}
+    }
+    output = explaining.predict_fn(request, model_assets).records()[0]
+    explanation = visuals.topk_explanation(output)
+    shap_values = output['explanation']['shap_values']
+    names = explanation['feature_names']
+    assert len(names) == 4 and names[-1] == 'other_features'
+    assert explanation['shap_values'][:3] == [shap_values[name] for name in names[:3]]
+    # the waterfall still adds up to the same score
+    np.testing.assert_allclose(sum(explanation['shap_values']), sum(shap_values.values()))
+    assert explanation['expected_value'] == output['explanation']['expected_value']
+    assert explanation['feature_values'][:3] == [output['features'][name] for name in names[:3]]  # noqa
+    assert len(explanation['feature_descriptions']) == 4
@@ -0,0 +1,70 @@
+from pathlib import Path
+import numpy as np
+import pytest
+
+import bundles
+import explaining
+
+
+ENTITIES = [
+    'features',
+    'prediction',
+    'explanation_shap_values',
+    'explanation_shap_interaction_values'
+]
+
+
+def test_save_load(tmp_path):
+    filepath = Path(tmp_path, bundles.FILENAME)
+    arrays = {
+        'a': np.arange(5, dtype=np.int32),
+        'b': np.ones((2, 3)),
+        'c': np.zeros(0, dtype=bool)
+    }
+    bundles.save(filepath, {'key': 'value'}, arrays)
+    metadata, loaded, checksum = bundles.load(filepath)
+    assert metadata == {'key': 'value'}
+    for name, array in arrays.items():
+        assert loaded[name].dtype == array.dtype
+        np.testing.assert_array_equal(loaded[name], array)
+        assert not loaded[name].flags.writeable
+    assert loaded['b'].ctypes.data % bundles.ALIGNMENT == 0
+
+
+def test_load_corrupted(tmp_path):
+    filepath = Path(tmp_path, bundles.FILENAME)
+    bundles.save(filepath, {}, {'a': np.arange(5)})
+    body = bytearray(filepath.read_bytes())
+    body[-1] ^= 1
+    filepath.write_bytes(bytes(body))
+    with pytest.raises(ValueError, match="checksum"):
+        bundles.load(filepath)
+    bundles.save(filepath, {'category': 'car'}, {'a': np.arange(5)})
+    body = filepath.read_bytes()
+    assert b'"car"' in body
+    filepath.write_bytes(body.replace(b'"car"', b'"bar"'))  # a single header byte
+    with pytest.raises(ValueError, match="checksum"):
+        bundles.load(filepath)
+    filepath.write_bytes(b"not a bundle" * 4)
+    with pytest.raises(ValueError, match="isn't a model bundle"):
+        bundles.load(filepath)
+
+
+def test_model_fn_bundle(records, model_dir, model_assets, legacy_model_assets):
+    assert Path(model_dir, bundles.FILENAME).exists()
+    assert model_assets["classifier"] is None
+    assert legacy_model_assets["classifier"] is not None
+    assert model_assets["explainer"].expected_value == pytest.approx(
+        legacy_model_assets["explainer"].expected_value
+    )
+    for entities in [ENTITIES, ['prediction']]:
+        request = {'data': records, 'entities': entities, 'batch': True}
+        predictions = explaining.predict_fn(request, model_assets).columns
+        expected = explaining.predict_fn(request, legacy_model_assets).columns
+        np.testing.assert_allclose(predictions['prediction'], expected['prediction'])  # noqa
+        if 'features' in entities:
+            np.testing.assert_array_equal(predictions['features'], expected['features'])  # noqa
+            for key in ['shap_values', 'shap_interaction_values']:
+                np.testing.assert_allclose(
+                    predictions['explanation'][key], expected['explanation'][key]
+                )
@@ -0,0 +1,51 @@
+import numpy as np
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder
+
+from preprocessing import CompiledPreprocessor
+import explaining
+
+
+def test_compiled_preprocessor(records, legacy_model_assets):
+    data_schema = legacy_model_assets["data_schema"]
+    preprocessor = legacy_model_assets["preprocessor"]
+    compiled_preprocessor = legacy_model_assets["compiled_preprocessor"]
+    assert compiled_preprocessor is not None
+    unknown = dict(records[0], credit__purpose="unknown")
+    for record in records + [unknown]:
+        expected = preprocessor.transform(data_schema.transform_batch([record]))
+        features = compiled_preprocessor.transform_record(record)
+        assert features.dtype == expected.dtype
+        np.testing.assert_array_equal(features, expected)
+        as_list = [record[title] for title in data_schema.item_titles]
+        np.testing.assert_array_equal(compiled_preprocessor.transform_record(as_list), expected)  # noqa
+
+
+def test_compiled_preprocessor_columns(records, legacy_model_assets):
+    data_schema = legacy_model_assets["data_schema"]
+    preprocessor = legacy_model_assets["preprocessor"]
+    compiled_preprocessor = legacy_model_assets["compiled_preprocessor"]
+    batch = records + [dict(records[0], credit__purpose="unknown")]
+    expected = preprocessor.transform(data_schema.transform_batch(batch))
+    features = compiled_preprocessor.transform_columns(data_schema.transform_columns(batch))  # noqa
+    assert features.dtype == expected.dtype
+    np.testing.assert_array_equal(features, expected)
+
+
+def test_compiled_preprocessor_unsupported(records, legacy_model_assets):
+    data_schema = legacy_model_assets["data_schema"]
+    preprocessor = ColumnTransformer(
+        transformers=[("categorical", OneHotEncoder(handle_unknown="error"), [3])]
+    )
+    preprocessor.fit(data_schema.transform_batch(records))
+    assert CompiledPreprocessor.from_preprocessor(preprocessor, data_schema) is None  # noqa
+
+
+def test_plan_fn_compiled():
+    plan = explaining.plan_fn(['features'], {}, compiled=True)
+    assert list(plan) == ['records', 'features']
+
+
+def test_plan_fn_columns():
+    plan = explaining.plan_fn(['features'], {}, compiled=True, columns=True)
+    assert list(plan) == ['records', 'columns', 'features']
@@ -0,0 +1,119 @@
+import io
+import json
+import os
+from pathlib import Path
+import signal
+import subprocess
+import sys
+import threading
+from urllib import request as urllib_request
+from urllib.error import HTTPError
+import numpy as np
+import pytest
+
+from package import utils
+import serving
+
+current_folder = utils.get_current_folder(globals())
+src_path = Path(current_folder, "../../containers/model/src").resolve()
+package_path = Path(current_folder, "..").resolve()
+
+CONTENT_TYPE = "application/json; entities=prediction,explanation_shap_values"
+
+
+def invoke(url, body, content_type=CONTENT_TYPE, accept="application/json"):
+    request = urllib_request.Request(
+        url + "/invocations",
+        data=body.encode("utf-8"),
+        headers={"Content-Type": content_type, "Accept": accept}
+    )
+    with urllib_request.urlopen(request, timeout=30) as response:
+        return response.status, response.headers, response.read()
+
+
+@pytest.fixture(scope="module")
+def server_url(model_assets):
+    server = serving.ModelServer(("127.0.0.1", 0), model_assets, threads=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_ping(server_url):
+    with urllib_request.urlopen(server_url + "/ping", timeout=30) as response:
+        assert response.status == 200
+
+
+def test_invocations(server_url, records):
+    status, headers, body = invoke(server_url, json.dumps(records[:3]))
+    assert status == 200
+    assert headers["Content-Type"] == "application/json"
+    responses = json.loads(body)
+    assert len(responses) == 3
+    assert all(0 < response['prediction'] < 1 for response in responses)
+    status, headers, body = invoke(
+        server_url, json.dumps(records[0]), accept="application/x-npz"
+    )
+    arrays = np.load(io.BytesIO(body), allow_pickle=False)
+    assert np.isclose(arrays['prediction'], responses[0]['prediction'])
+
+
+def test_invocations_bad_request(server_url, records):
+    with pytest.raises(HTTPError) as error:
+        invoke(server_url, json.dumps(records[0]), content_type="text/plain")
+    assert error.value.code == 400
+
+
+def test_invocations_invalid_record(server_url, records):
+    record = dict(records[0], credit__amount='a lot')
+    with pytest.raises(HTTPError) as error:
+        invoke(server_url, json.dumps(record))
+    assert error.value.code == 400
+    assert b"is not of type 'integer'" in error.value.read()
+
+
+def test_invocations_not_a_record(server_url):
+    with pytest.raises(HTTPError) as error:
+        invoke(server_url, json.dumps(5))
+    assert error.value.code == 400
+    assert b"should be list or dict" in error.value.read()
+
+
+def test_memory_usage():
+    memory = serving.memory_usage()
+    if memory is not None:
+        assert 0 < memory["uss"] <= memory["pss"] <= memory["rss"]
+
+
+def test_serving_workers(model_dir, records):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(src_path), str(package_path)]))  # noqa
+    process = subprocess.Popen(
+        [
+            sys.executable, str(Path(src_path, "serving.py")),
+            "--model-dir", str(model_dir),
+            "--host", "127.0.0.1",
+            "--port", "0",
+            "--workers", "2"
+        ],
+        env=env, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        line = process.stdout.readline()
+        url = "http://" + line.strip().split(" on ")[1].split(" ")[0]
+        for record in records[:4]:
+            status, _, body = invoke(url, json.dumps(record))
+            assert status == 200
+            assert 'prediction' in json.loads(body)
+        # workers share most of their memory with the parent (copy-on-write)
+        children = Path("/proc/{0}/task/{0}/children".format(process.pid))
+        if children.exists():
+            pids = children.read_text().split()
+            assert len(pids) == 2
+            for pid in pids:
+                memory = serving.memory_usage(pid)
+                assert memory["uss"] < memory["rss"] / 2
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=30) == 0